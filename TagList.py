@@ -1,9 +1,7 @@
 """ Class containing methods for generating, saving, loading, and printing 2-D barcode tags """
 
 import numpy as np
-import matplotlib.pyplot as plt
 import pickle
-import numpy as np
 import utils
 
 
@@ -175,63 +173,226 @@ class TagList:
 		self.loaded = True
 
 
+	def sheet_layout(self, tag_size_mm = 6.0, page_size_mm = (210.0, 297.0), margin_mm = 10.0, spacing_mm = None, ncols = None, id_fontsize = 5):
+
+		"""Compute the grid of tags on a page, all sizes in mm.
+
+		Each grid cell holds an orientation arrow above the tag, the tag, and its ID label below.
+
+		Returns
+		-------
+		layout : dict
+			'module' (size of one bit), 'tag' (bordered tag width), 'cell' (cell width and height),
+			'ncols', 'nrows', 'origin' (top-left corner of the grid) and 'label' (label height).
+		"""
+
+		border_shape = (self.tag_shape[0] + 2*(self.white_width + self.black_width), self.tag_shape[1] + 2*(self.white_width + self.black_width))
+		module = tag_size_mm / border_shape[1]
+		if spacing_mm is None:
+			spacing_mm = tag_size_mm / 2.0
+		label = id_fontsize * 25.4 / 72 * 1.3
+		arrow = tag_size_mm / 3.0
+		cell = (tag_size_mm + spacing_mm, arrow + module*border_shape[0] + label + spacing_mm)
+
+		usable = (page_size_mm[0] - 2*margin_mm + spacing_mm, page_size_mm[1] - 2*margin_mm + spacing_mm)
+		max_cols = int(usable[0] / cell[0] + 1e-9)
+		ncols = max_cols if ncols is None else min(ncols, max_cols)
+		nrows = int(usable[1] / cell[1] + 1e-9)
+		assert ncols > 0 and nrows > 0, "tags do not fit on the page"
+
+		return {"module" : module, "tag" : tag_size_mm, "border_shape" : border_shape, "arrow" : arrow,
+				"label" : label, "cell" : cell, "ncols" : ncols, "nrows" : nrows, "fontsize" : id_fontsize,
+				"origin" : (margin_mm, margin_mm), "page" : page_size_mm}
+
+	def printed_tags(self, ids = None):
+
+		"""Returns (ID, bordered tag as 2-D array) for each tag to print, in ID order.
+
+		The fourth rotation of every ID is printed, which is the orientation contour_loop() measures
+		angles against (arrow up).
+		"""
+
+		tags = []
+		for i, tag in enumerate(self.master_list):
+			if (i+1) % 4 == 0:
+				ID = int(self.id_list[i])
+				if ids is None or ID in ids:
+					border_shape, tag = utils.add_border(tag, self.tag_shape, self.white_width, self.black_width)
+					tags.append((ID, tag.reshape(border_shape)))
+		return tags
+
+	def render_sheets(self, file, tag_size_mm = 6.0, page_size_mm = (210.0, 297.0), margin_mm = 10.0, spacing_mm = None, ncols = None,
+					  id_fontsize = 5, id_digits = 5, ids = None, dpi = 600):
+
+		"""Draw tags with orientation arrows and ID labels at exact physical size.
+
+		Parameters
+		----------
+		file : str
+			Output path. A `.pdf` is written as one vector PDF with as many pages as needed. Any other
+			extension is rendered as a raster image per page at dpi, numbered `name_001.png`, ... when
+			there is more than one page. Raster output rounds the size of a bit to whole pixels.
+		tag_size_mm : float, default = 6.0
+			Printed width of a tag including its border.
+		page_size_mm : tuple of float, default = (210.0, 297.0)
+			Page width and height, default is A4.
+		margin_mm : float, default = 10.0
+			Page margin.
+		spacing_mm : float, default = None
+			Gap between tags, defaults to half the tag size.
+		ncols : int, default = None
+			Number of columns, defaults to as many as fit on the page.
+		id_fontsize : float, default = 5
+			Font size of the ID label in points.
+		id_digits : int, default = 5
+			Number of digits of the ID label (zero pads the left side of the number).
+		ids : list of int, default = None
+			IDs to print, defaults to all tags.
+		dpi : int, default = 600
+			Resolution of raster output.
+
+		Returns
+		-------
+		files : list of str
+			Written files.
+		"""
+
+		layout = self.sheet_layout(tag_size_mm, page_size_mm, margin_mm, spacing_mm, ncols, id_fontsize)
+		tags = self.printed_tags(ids)
+		per_page = layout["ncols"] * layout["nrows"]
+		pages = [tags[start:start + per_page] for start in range(0, len(tags), per_page)]
+
+		if file.lower().endswith(".pdf"):
+			utils.write_pdf([self.pdf_page(page, layout, id_digits) for page in pages],
+							(page_size_mm[0]*72/25.4, page_size_mm[1]*72/25.4), file)
+			return [file]
+
+		import cv2
+		name, extension = file.rsplit(".", 1)
+		files = []
+		for number, page in enumerate(pages, 1):
+			page_file = file if len(pages) == 1 else "{}_{:03d}.{}".format(name, number, extension)
+			cv2.imwrite(page_file, self.raster_page(page, layout, id_digits, dpi))
+			files.append(page_file)
+		return files
+
+	def pdf_page(self, page, layout, id_digits):
+
+		"""Returns the PDF content stream drawing the (ID, tag) pairs of one page."""
+
+		pt = 72 / 25.4
+		page_height = layout["page"][1]
+		module = layout["module"]
+		fontsize = layout["fontsize"]
+		ops = []
+
+		for n, (ID, tag) in enumerate(page):
+			x0 = layout["origin"][0] + (n % layout["ncols"]) * layout["cell"][0]
+			y0 = layout["origin"][1] + (n // layout["ncols"]) * layout["cell"][1]
+			tag_top = y0 + layout["arrow"]
+			center = x0 + layout["tag"]/2.0
+
+			# arrow pointing to the top edge of the tag
+			arrow = layout["arrow"]
+			ops.append("0 g %.3f w %.3f %.3f m %.3f %.3f l S" % (arrow*0.12*pt, center*pt, (page_height - tag_top + arrow*0.2)*pt,
+																 center*pt, (page_height - y0 - arrow*0.35)*pt))
+			ops.append("%.3f %.3f m %.3f %.3f l %.3f %.3f l f" % ((center - arrow*0.3)*pt, (page_height - y0 - arrow*0.45)*pt,
+																  center*pt, (page_height - y0)*pt,
+																  (center + arrow*0.3)*pt, (page_height - y0 - arrow*0.45)*pt))
+
+			# black modules, merged into runs along each row
+			for row in range(tag.shape[0]):
+				y = page_height - tag_top - (row + 1)*module
+				col = 0
+				while col < tag.shape[1]:
+					if tag[row, col] == 0:
+						run = col
+						while run < tag.shape[1] and tag[row, run] == 0:
+							run += 1
+						ops.append("%.3f %.3f %.3f %.3f re" % ((x0 + col*module)*pt, y*pt, (run - col)*module*pt, module*pt))
+						col = run
+					else:
+						col += 1
+			ops.append("f")
+
+			# white ID on a black label below the tag
+			label_top = tag_top + tag.shape[0]*module
+			ops.append("%.3f %.3f %.3f %.3f re f" % (x0*pt, (page_height - label_top - layout["label"])*pt, layout["tag"]*pt, layout["label"]*pt))
+			text = str(ID).zfill(id_digits)
+			text_width = len(text) * 0.556 * fontsize # Helvetica digits are 0.556 em wide
+			ops.append("1 g BT /F1 %.2f Tf %.3f %.3f Td (%s) Tj ET" % (fontsize, center*pt - text_width/2.0,
+																		(page_height - label_top - layout["label"]*0.8)*pt, text))
+		return "\n".join(ops)
+
+	def raster_page(self, page, layout, id_digits, dpi):
+
+		"""Returns one page of (ID, tag) pairs as a uint8 grayscale image at dpi."""
+
+		import cv2
+		px = dpi / 25.4
+		canvas = np.full((int(round(layout["page"][1]*px)), int(round(layout["page"][0]*px))), 255, dtype = np.uint8)
+		module_px = max(1, int(round(layout["module"]*px)))
+		label_px = int(round(layout["label"]*px))
+		font_scale = cv2.getFontScaleFromHeight(cv2.FONT_HERSHEY_SIMPLEX, max(1, int(label_px*0.6)))
+
+		for n, (ID, tag) in enumerate(page):
+			x0 = int(round((layout["origin"][0] + (n % layout["ncols"]) * layout["cell"][0])*px))
+			y0 = int(round((layout["origin"][1] + (n // layout["ncols"]) * layout["cell"][1])*px))
+			arrow_px = int(round(layout["arrow"]*px))
+			tag_px = cv2.resize((tag*255).astype(np.uint8), (tag.shape[1]*module_px, tag.shape[0]*module_px), interpolation = cv2.INTER_NEAREST)
+			center = x0 + tag_px.shape[1]//2
+
+			cv2.arrowedLine(canvas, (center, y0 + arrow_px - max(1, arrow_px//5)), (center, y0), 0, max(1, arrow_px//8), tipLength = 0.4)
+			top = y0 + arrow_px
+			canvas[top:top + tag_px.shape[0], x0:x0 + tag_px.shape[1]] = tag_px
+
+			label_top = top + tag_px.shape[0]
+			canvas[label_top:label_top + label_px, x0:x0 + tag_px.shape[1]] = 0
+			text = str(ID).zfill(id_digits)
+			(text_w, text_h), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 1)
+			cv2.putText(canvas, text, (center - text_w//2, label_top + (label_px + text_h)//2), cv2.FONT_HERSHEY_SIMPLEX,
+						font_scale, 255, 1, cv2.LINE_AA)
+		return canvas
+
 	def print_tags(self, file, ntags = 200, page_size = (8.26, 11.69), ncols = 20, id_fontsize = 5, arrow_fontsize = 10, id_digits = 5, show = True):
 
 		"""Print tags as image file or PDF. Default settngs are for ~6-mm wide tags.
 
+		Draws with render_sheets(); tags that do not fit on one page continue on further pages.
+
 		Parameters
 		----------
 		file : str
 			Location for saving the barcode images, must be `.pdf` or image (`.png`, `.jpg`, etc.) file extension.
 		ntags : int, default = 200
-			Number of tags per page.
+			Number of tags to print.
 		page_size : tuple of float, default = (8.26, 11.69)
-			Size of the printed page, default is A4. 
+			Size of the printed page in inches, default is A4.
 		ncols : int, default = 20
 			Number of columns.
 		id_fontsize : int, default = 5
 			Font size for ID number.
 		arrow_fontsize : int, default = 10
-			Font size for arrow.
+			Unused, the arrow is scaled with the tag.
 		id_digits : int, default = 5
 			Number of digits for ID number printed below barcode (zero pads the left side of the number).
 		show : bool
-			Show the figure using plt.show()
+			Show the first page using plt.show()
 
 		"""
 
-		self.fig = plt.figure(figsize = page_size)
-		plot = 1
-		for i, tag in enumerate(self.master_list):
-			if (i+1) % 4 == 0 and plot <= ntags:
-
-				border_shape, tag = utils.add_border(tag, self.tag_shape, self.white_width, self.black_width)
-				tag = tag.reshape(border_shape)
-
-				ax = plt.subplot(int(ntags/ncols), ncols, plot)
-				tag_number = str((i+1)/4)
-
-				if len(tag_number) < id_digits:
-					tag_number = "0"*(id_digits-len(tag_number)) + tag_number
-				
-				ax.set_title(u"\u2191", fontsize = arrow_fontsize, family = "Arial", weight = "heavy")
-				ax.set_xlabel(tag_number, fontsize = id_fontsize, family = "Arial", weight = 'light', color = 'white', backgroundcolor = 'black', bbox = {'fc': 'black', 'ec': 'none'})
-				ax.set_aspect(1)
-				ax.xaxis.set_ticks_position('none')
-				ax.yaxis.set_ticks_position('none')
-				ax.get_xaxis().set_ticks([])
-				ax.get_yaxis().set_ticks([])
-				ax.xaxis.set_label_coords(0.5, -0.1)
-
-				ax.imshow(tag, cmap='gray', interpolation = 'nearest', zorder = 200)
-
-				
-
-				plot += 1
-
-		plt.savefig(file, dpi=600, interpolation = 'none')
+		page_size_mm = (page_size[0]*25.4, page_size[1]*25.4)
+		margin_mm = 10.0
+		# ncols columns of tags with half a tag of space between them
+		tag_size_mm = min(6.0, (page_size_mm[0] - 2*margin_mm) / (ncols*1.5 - 0.5))
+		ids = [int(ID) for ID in self.id_list[3::4][:ntags]]
+		self.render_sheets(file, tag_size_mm, page_size_mm, margin_mm, ncols = ncols, id_fontsize = id_fontsize, id_digits = id_digits, ids = ids)
 
 		if show == True:
+			import matplotlib.pyplot as plt
+			layout = self.sheet_layout(tag_size_mm, page_size_mm, margin_mm, None, ncols, id_fontsize)
+			page = self.raster_page(self.printed_tags(ids)[:layout["ncols"]*layout["nrows"]], layout, id_digits, 150)
+			plt.figure(figsize = page_size)
+			plt.imshow(page, cmap = 'gray', interpolation = 'nearest')
+			plt.axis('off')
 			plt.show()
-
-
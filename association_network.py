@@ -0,0 +1,200 @@
+""" Co-occurrence counts and association indices between IDs from the collated detections.
+
+Detections of a population are cut into fixed time windows of --window seconds, counted as gathering
+events. For each day the events and IDs form a sparse binary incidence matrix X (event x ID), and
+X^T X holds, on the diagonal, the number of events each ID was seen in and, off the diagonal, the
+number of events two IDs were seen in together. From these the simple ratio index
+
+    SRI = x / (n_a + n_b - x)
+
+and the half-weight index HWI = 2x / (n_a + n_b) are computed, x being the events together and n_a,
+n_b the events of each ID. Counts of different days add up, so longer periods are combined from the
+per-day edge lists with combine_edges().
+
+Usage: python3 association_network.py [--data-dir coallated_data] [--out-dir association] [--window 10]
+                                      [--camera Social] [--populations P1 P2 ...]
+
+Reads ``<data_dir>/<population>_<camera>_full.csv`` as written by concat_dataframes.py and writes one
+``<out_dir>/<population>_<camera>_<window>s/<date>.csv`` edge list per day. A state file records the
+number of detections of every day written; days whose count is unchanged are skipped on the next run,
+so rerunning after the daily collation only computes the new days and the day that was still running.
+"""
+
+import os
+import json
+import argparse
+from os.path import join, isfile
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from concat_dataframes import read_detection_file
+
+edge_columns = ["population", "date", "id_a", "id_b", "together", "n_a", "n_b", "sri", "hwi"]
+
+
+def read_detections(data_filepath, min_prob = 0.0):
+
+    """ Returns the population, time and id columns of a collated file, sorted by time """
+
+    df = read_detection_file(data_filepath, usecols = ["population", "time", "id", "id_prob"])
+    if min_prob > 0:
+        df = df[df["id_prob"] >= min_prob]
+    return df.sort_values("time", kind = "stable").reset_index(drop = True)
+
+
+def cooccurrence(event_index, id_index, n_ids):
+
+    """Count events per ID and events shared by each pair of IDs.
+
+        Parameters
+        ----------
+        event_index : 1-D array of int
+            Event (time window) of every detection, need not be contiguous.
+        id_index : 1-D array of int
+            Column of every detection's ID, in range(n_ids).
+        n_ids : int
+            Number of IDs.
+
+        Returns
+        -------
+        counts : 1-D array of int
+            Number of events each ID was seen in.
+        pairs : tuple of 1-D arrays
+            (i, j, together) for every pair i < j seen together in at least one event.
+        """
+
+    # renumber the events so that the matrix has one row per event that occurred
+    events, rows = np.unique(event_index, return_inverse = True)
+    X = sparse.csr_matrix((np.ones(len(rows), dtype = np.int32), (rows, id_index)), shape = (len(events), n_ids))
+    X.sum_duplicates()
+    X.data[:] = 1 # several detections of an ID in one event count once
+
+    C = (X.T @ X).tocoo()
+    upper = C.row < C.col
+    counts = np.asarray(X.sum(axis = 0)).ravel()
+    return counts, (C.row[upper], C.col[upper], C.data[upper])
+
+
+def day_edges(population, date, event_index, id_index, ids):
+
+    """ Returns the edge list DataFrame of one day, see edge_columns """
+
+    counts, (i, j, together) = cooccurrence(event_index, id_index, len(ids))
+    n_a = counts[i]
+    n_b = counts[j]
+    edges = pd.DataFrame({"population" : population, "date" : date, "id_a" : ids[i], "id_b" : ids[j],
+                          "together" : together, "n_a" : n_a, "n_b" : n_b,
+                          "sri" : together / (n_a + n_b - together).astype(np.float64),
+                          "hwi" : 2.0 * together / (n_a + n_b)}, columns = edge_columns)
+    return edges.sort_values(["id_a", "id_b"]).reset_index(drop = True)
+
+
+def network_by_day(detections, window = 10):
+
+    """Yields (date, number of detections, edge list) for every day of one population's detections.
+
+        Parameters
+        ----------
+        detections : DataFrame
+            population, time and id columns sorted by time, see read_detections().
+        window : float, default = 10
+            Length of a gathering event in seconds.
+        """
+
+    population = str(detections["population"].iloc[0])
+    ids, id_index = np.unique(detections["id"].to_numpy(), return_inverse = True)
+    seconds = detections["time"].to_numpy().astype("datetime64[us]").astype(np.int64) / 1e6
+    event_index = np.floor(seconds / window).astype(np.int64)
+
+    # detections are sorted, so every day is one slice
+    days = detections["time"].dt.normalize().to_numpy()
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    ends = np.r_[starts[1:], len(days)]
+    for start, end in zip(starts, ends):
+        date = pd.Timestamp(days[start]).strftime("%Y-%m-%d")
+        present = np.unique(id_index[start:end])
+        # drop the IDs absent on this day so that the matrix stays small
+        local = np.searchsorted(present, id_index[start:end])
+        yield date, end - start, day_edges(population, date, event_index[start:end], local, ids[present])
+
+
+def update_network(data_filepath, out_dir, window = 10, min_prob = 0.0):
+
+    """Write the per-day edge lists of one collated file, skipping days already written.
+
+        Parameters
+        ----------
+        data_filepath : str
+            Collated ``<population>_<camera>_full.csv``.
+        out_dir : str
+            Directory receiving ``<date>.csv`` edge lists and the state file.
+        window : float, default = 10
+            Length of a gathering event in seconds.
+        min_prob : float, default = 0.0
+            Ignore detections with a lower id_prob.
+
+        Returns
+        -------
+        written : list of str
+            Dates whose edge list was (re)written.
+        """
+
+    os.makedirs(out_dir, exist_ok = True)
+    state_filepath = join(out_dir, "state.json")
+    state = {"window" : window, "min_prob" : min_prob, "days" : {}}
+    if isfile(state_filepath):
+        with open(state_filepath) as state_file:
+            saved = json.load(state_file)
+        if saved["window"] == window and saved["min_prob"] == min_prob:
+            state = saved
+
+    detections = read_detections(data_filepath, min_prob)
+    if len(detections) == 0:
+        return []
+
+    written = []
+    for date, n_detections, edges in network_by_day(detections, window):
+        if state["days"].get(date) == n_detections and isfile(join(out_dir, "{}.csv".format(date))):
+            continue
+        edges.to_csv(join(out_dir, "{}.csv".format(date)), index = False)
+        state["days"][date] = int(n_detections)
+        written.append(date)
+
+    with open(state_filepath + ".tmp", "w") as state_file:
+        json.dump(state, state_file, indent = 1, sort_keys = True)
+    os.replace(state_filepath + ".tmp", state_filepath)
+    return written
+
+
+def combine_edges(edge_lists):
+
+    """ Returns the edge list of a period from per-day edge lists, summing events before computing the indices """
+
+    edges = pd.concat(edge_lists, ignore_index = True)
+    period = "{}/{}".format(edges["date"].min(), edges["date"].max())
+    edges = edges.groupby(["population", "id_a", "id_b"], as_index = False, observed = True)[["together", "n_a", "n_b"]].sum()
+    edges["date"] = period
+    edges["sri"] = edges["together"] / (edges["n_a"] + edges["n_b"] - edges["together"]).astype(np.float64)
+    edges["hwi"] = 2.0 * edges["together"] / (edges["n_a"] + edges["n_b"])
+    return edges[edge_columns]
+
+
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(description = "Per-day association networks from the collated detections.")
+    parser.add_argument("--data-dir", default = "/home/michael/pinpoint_exp2/coallated_data")
+    parser.add_argument("--out-dir", default = "/home/michael/pinpoint_exp2/association")
+    parser.add_argument("--window", type = float, default = 10, help = "length of a gathering event in seconds")
+    parser.add_argument("--camera", default = "Social")
+    parser.add_argument("--populations", nargs = "+", default = ["P1","P2","P3","P4","P5","P6","P7","P8","P9","P10"])
+    parser.add_argument("--min-prob", type = float, default = 0.0, help = "ignore detections with a lower id_prob")
+    args = parser.parse_args()
+
+    for population in args.populations:
+        data_filepath = join(args.data_dir, "{}_{}_full.csv".format(population, args.camera))
+        if not isfile(data_filepath):
+            continue
+        out_dir = join(args.out_dir, "{}_{}_{:g}s".format(population, args.camera, args.window))
+        written = update_network(data_filepath, out_dir, args.window, args.min_prob)
+        print("{} {}: {} days written".format(population, args.camera, len(written)))
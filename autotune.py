@@ -0,0 +1,257 @@
+""" Search the detection parameters of decode() for the fastest setting that keeps a target recall and precision.
+
+Usage: python3 autotune.py <sample_dir> <population> <camera> [--recall 0.95] [--precision 0.98] [--trials 60]
+
+sample_dir holds a frames/ folder and a labels.csv with ``time,id`` (and optionally x,y) per tag in view,
+as written by synthetic_frames.py. Use --synthetic N to generate N synthetic frames into sample_dir first.
+camera is the profile name the result is saved under, a camera type ('Feeder') or a camera ('P3_Feeder').
+Candidate settings are evaluated in parallel processes; the winner is written to camera_profiles/<camera>.json
+where decode() picks it up.
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+from os.path import join
+
+import numpy as np
+import camera_profiles
+from synthetic_frames import read_labels
+
+header = "population,time,id,id_prob,x,y,orientation\n"
+
+# values tried for each parameter, the area limits are given for resize_param 0.8 and scaled with the resize
+search_space = {
+    "resize_param" : [0.5, 0.6, 0.7, 0.8, 0.9, 1.0],
+    "pyramid_levels" : [0, 1, 2],
+    "block_size" : [251, 501, 1001],
+    "offset_values" : [[-70,-50,-30,-10,0,2], [-70,-30,0], [-50,-10,2], [-70,-10], [-30,0]],
+    "lower_size_limit" : [40, 70, 100],
+    "upper_size_limit" : [300, 400, 600],
+    "max_contour_points" : [30, 50, 80],
+    "poly_epsilon" : [0.05, 0.1, 0.15],
+    "match_threshold" : [0.7, 0.8, 0.85],
+    "decoding" : ["hash", "correlation"],
+}
+reference_resize = 0.8
+
+tags = None
+
+
+def init_worker(tag_filename):
+    global tags
+    import TagList
+    tags = TagList.TagList()
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        tags.load(tag_filename)
+
+
+def baseline_params(base = None, camera = None):
+
+    """ Returns the current setting of a camera, base defaults to default_params
+
+    Without a resize_param the camera runs at camera_profiles.default_resize_param() of its name, or at
+    the reference resize if no camera is given.
+    """
+
+    params = dict(camera_profiles.default_params if base is None else base)
+    if params["resize_param"] is None:
+        params["resize_param"] = reference_resize if camera is None else camera_profiles.default_resize_param(camera)
+    return params
+
+
+def sample_params(rng, n_trials, base = None, camera = None):
+
+    """ Returns n_trials parameter sets drawn from search_space, starting with the current setting
+
+    Keys outside search_space, such as the camera's roi, keep their values from base.
+    """
+
+    baseline = baseline_params(base, camera)
+    trials = [baseline]
+    seen = set([json.dumps(baseline, sort_keys = True)])
+
+    for attempt in range(100*n_trials):
+        if len(trials) >= n_trials:
+            break
+        params = dict(baseline)
+        for key, values in search_space.items():
+            params[key] = values[rng.randint(len(values))]
+        if params["lower_size_limit"] >= params["upper_size_limit"]:
+            continue
+        area_scale = (params["resize_param"]/reference_resize)**2
+        params["lower_size_limit"] = int(round(params["lower_size_limit"]*area_scale))
+        params["upper_size_limit"] = int(round(params["upper_size_limit"]*area_scale))
+        key = json.dumps(params, sort_keys = True)
+        if key not in seen:
+            seen.add(key)
+            trials.append(params)
+    return trials
+
+
+def score(detections, labels):
+
+    """ Returns (precision, recall) of decode() detections against labels, both dicts of (time, id) -> count """
+
+    true_positives = sum(min(count, labels.get(key, 0)) for key, count in detections.items())
+    n_detections = sum(detections.values())
+    n_labels = sum(labels.values())
+    precision = true_positives/float(n_detections) if n_detections > 0 else 1.0
+    recall = true_positives/float(n_labels) if n_labels > 0 else 1.0
+    return precision, recall
+
+
+def read_detection_counts(data_filepath):
+
+    """ Returns a dict mapping (time, id) to the number of detections in a decode() output file """
+
+    detections = {}
+    with open(data_filepath) as data_file:
+        next(data_file)
+        for line in data_file:
+            fields = line.split(",")
+            key = (fields[1], int(fields[2]))
+            detections[key] = detections.get(key, 0) + 1
+    return detections
+
+
+def evaluate(args):
+
+    """ Runs decode() with params over frames_dir and returns (params, seconds per image, precision, recall) """
+
+    from barcode_tracker_photos_modified import decode
+
+    params, frames_dir, labels, population = args
+    n_images = len(os.listdir(frames_dir))
+
+    with tempfile.NamedTemporaryFile("w", suffix = ".csv", delete = False) as savefile:
+        savefile.write(header)
+        data_filepath = savefile.name
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            t0 = time.time()
+            decode(frames_dir, data_filepath, tags, population, params = params)
+            elapsed = time.time() - t0
+        detections = read_detection_counts(data_filepath)
+    finally:
+        os.remove(data_filepath)
+
+    precision, recall = score(detections, labels)
+    return params, elapsed/max(n_images, 1), precision, recall
+
+
+def autotune(sample_dir, population, min_recall = 0.95, min_precision = 0.98, n_trials = 60,
+             processes = None, tag_filename = "master_list_outdoor.pkl", seed = 0, verbose = True, base = None,
+             camera = None):
+
+    """Evaluate n_trials parameter sets in parallel and return the fastest one meeting the targets.
+
+        Parameters
+        ----------
+        sample_dir : str
+            Folder with frames/ and labels.csv.
+        population : str
+            Population whose approved IDs are matched, e.g. 'P1'.
+        min_recall, min_precision : float, default = 0.95, 0.98
+            Targets the returned setting must reach on the sample set.
+        n_trials : int, default = 60
+            Number of parameter sets tried, the first is the camera's current setting.
+        processes : int, default = None
+            Worker processes, defaults to the number of cores. Timings are comparable between trials
+            only if every process has a core to itself.
+        tag_filename : str, default = "master_list_outdoor.pkl"
+            TagList file.
+        seed : int, default = 0
+            Random seed of the search.
+        verbose : bool, default = True
+            Print every trial.
+        base : dict, default = None
+            Current parameters of the camera, see camera_profiles.load_profile(). Trials start from it
+            and keep its values outside search_space; default_params if None.
+        camera : str, default = None
+            Camera or camera type base belongs to, gives the resize of the first trial when base has none.
+
+        Returns
+        -------
+        best : tuple or None
+            (params, seconds per image, precision, recall) of the fastest qualifying setting,
+            None if no trial reached the targets.
+        results : list of tuple
+            All trials in the same format, fastest first.
+        """
+
+    frames_dir = join(sample_dir, "frames")
+    labels = read_labels(join(sample_dir, "labels.csv"))
+    trials = sample_params(np.random.RandomState(seed), n_trials, base, camera)
+
+    pool = multiprocessing.Pool(processes, initializer = init_worker, initargs = (tag_filename,))
+    try:
+        results = []
+        for result in pool.imap_unordered(evaluate, [(params, frames_dir, labels, population) for params in trials]):
+            results.append(result)
+            if verbose:
+                params, seconds, precision, recall = result
+                print("{:>3}/{} {:.3f} s/image precision {:.3f} recall {:.3f}".format(len(results), len(trials), seconds, precision, recall))
+    finally:
+        pool.close()
+        pool.join()
+
+    results = sorted(results, key = lambda result: result[1])
+    qualifying = [result for result in results if result[2] >= min_precision and result[3] >= min_recall]
+    best = qualifying[0] if len(qualifying) > 0 else None
+    return best, results
+
+
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(description = "Find the fastest decode() parameters reaching a target recall and precision.")
+    parser.add_argument("sample_dir")
+    parser.add_argument("population")
+    parser.add_argument("camera", help = "profile name to save, e.g. Feeder or P3_Feeder")
+    parser.add_argument("--recall", type = float, default = 0.95)
+    parser.add_argument("--precision", type = float, default = 0.98)
+    parser.add_argument("--trials", type = int, default = 60)
+    parser.add_argument("--processes", type = int, default = None)
+    parser.add_argument("--synthetic", type = int, default = 0, help = "generate this many synthetic frames into sample_dir first")
+    parser.add_argument("--dry-run", action = "store_true", help = "report the result without saving the profile")
+    args = parser.parse_args()
+
+    if args.synthetic > 0:
+        import TagList
+        from synthetic_frames import make_frames
+        from barcode_tracker_photos_modified import approved_ids
+        tags = TagList.TagList()
+        tags.load("master_list_outdoor.pkl")
+        make_frames(args.sample_dir, tags, approved_ids(args.population), n_images = args.synthetic,
+                    camera = "{}_{}".format(args.population, args.camera.split("_")[-1]))
+
+    # a camera ('P3_Feeder') starts from its type and camera profiles, a camera type ('Feeder') from its own
+    if camera_profiles.camera_key(args.camera) is not None:
+        base = camera_profiles.load_profile(args.camera)
+    else:
+        base = dict(camera_profiles.default_params, **camera_profiles.read_profile(args.camera))
+    best, results = autotune(args.sample_dir, args.population, args.recall, args.precision, args.trials, args.processes,
+                             base = base, camera = args.camera)
+
+    baseline = [result for result in results if result[0] == baseline_params(base, args.camera)]
+    if best is None:
+        print("no setting reached precision {} and recall {}".format(args.precision, args.recall))
+        sys.exit(1)
+
+    params, seconds, precision, recall = best
+    print("fastest qualifying setting: {:.3f} s/image, precision {:.3f}, recall {:.3f}".format(seconds, precision, recall))
+    if len(baseline) > 0:
+        print("current setting: {:.3f} s/image, precision {:.3f}, recall {:.3f}".format(*baseline[0][1:]))
+    print(json.dumps(params, indent = 4, sort_keys = True))
+
+    if not args.dry_run:
+        # only the tuned keys, so the rest of the profile (roi, hash settings) is left as it is
+        params = dict((key, params[key]) for key in search_space)
+        params["autotune"] = {"seconds_per_image" : seconds, "precision" : precision, "recall" : recall,
+                              "sample_dir" : os.path.abspath(args.sample_dir), "population" : args.population}
+        print("saved {}".format(camera_profiles.save_profile(args.camera, params)))
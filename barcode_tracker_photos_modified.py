@@ -2,11 +2,12 @@
 import cv2
 import numpy as np
 import datetime as dt
-from scipy.spatial import distance as dist
 import os
 from os.path import isfile, isdir, join, splitext, ismount, getsize
 import TagList
+import camera_profiles
 import re
+import itertools
 from sys import stdout
 
 
@@ -77,7 +78,7 @@ def order_points(pts):
     # top-left and right-most points; by the Pythagorean
     # theorem, the point with the largest distance will be
     # our bottom-right point
-    D = dist.cdist(tl[np.newaxis], right, "euclidean")[0]
+    D = np.sqrt(np.sum(np.square(right - tl), axis = 1))
     (br, tr) = right[np.argsort(D)[::-1], :]
 
     # return the coordinates in top-left, top-right,
@@ -132,7 +133,7 @@ def angle(vector, degrees = True):
         angle = np.degrees(angle)
     return angle
 
-def get_grayscale(color_image, channel = None):
+def get_grayscale(color_image, channel = None, dst = None):
 
     """ Returns single-channel grayscale image from 3-channel BGR color image.
         Parameters
@@ -144,6 +145,8 @@ def get_grayscale(color_image, channel = None):
             None and 'none' default to cv2.cvtColor() using cv2.COLOR_BGR2GRAY.
             Channels 'blue', 'green', and 'red' use the respective color channel as the grayscale image.
             Channel 'green' typically provides the lowest noise, but this will depend on the lighting in the image.
+        dst : (MxNx1) numpy array, default = None
+            Preallocated uint8 output buffer, a new array is allocated if None.
         Returns
         -------
         gray_image : (MxNx1) numpy array
@@ -157,18 +160,19 @@ def get_grayscale(color_image, channel = None):
     assert color_image.shape[2] == 3, "image must have 3 color channels"
     assert color_image.dtype == np.uint8, "image array must be dtype np.uint8"
 
+    # extract only the requested channel, cv2.split() would copy all three
     if channel == 'blue':
-        gray_image, _, _ = cv2.split(color_image)
+        gray_image = cv2.extractChannel(color_image, 0, dst = dst)
     if channel == 'green':
-            _, gray_image, _ = cv2.split(color_image)
+        gray_image = cv2.extractChannel(color_image, 1, dst = dst)
     if channel == 'red':
-        _, _, gray_image = cv2.split(color_image)
+        gray_image = cv2.extractChannel(color_image, 2, dst = dst)
     if channel == None or channel == 'none':
-        gray_image = cv2.cvtColor(color_image, cv2.COLOR_BGR2GRAY)
+        gray_image = cv2.cvtColor(color_image, cv2.COLOR_BGR2GRAY, dst = dst)
 
     return gray_image
 
-def get_threshold(gray_image, block_size = 1001, offset = 2):
+def get_threshold(gray_image, block_size = 1001, offset = 2, dst = None):
 
     """ Returns binarized thresholded image from single-channel grayscale image.
         Parameters
@@ -180,6 +184,8 @@ def get_threshold(gray_image, block_size = 1001, offset = 2):
         offset : default = 2
             Constant subtracted from the mean. Normally, it is positive but may be zero or negative as well.
             The threshold value T(x,y) is a mean of the block_size x block_size neighborhood of (x, y) minus offset.
+        dst : (MxNx1) numpy array, default = None
+            Preallocated uint8 output buffer, a new array is allocated if None.
         Returns
         -------
         threshold_image : (MxNx1) numpy array
@@ -192,17 +198,20 @@ def get_threshold(gray_image, block_size = 1001, offset = 2):
     assert len(gray_image.shape) == 2, "image must be grayscale"
     assert gray_image.dtype == np.uint8, "image array must be dtype np.uint8"
 
-    threshold_image = cv2.adaptiveThreshold(gray_image, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block_size, offset)
+    threshold_image = cv2.adaptiveThreshold(gray_image, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block_size, offset, dst = dst)
 
     return threshold_image
 
-def get_contours(threshold_image):
+def get_contours(threshold_image, copy = True):
 
     """ Returns a list of contours from a binarized thresholded image.
         Parameters
         ----------
         threshold_image : (MxNx1) numpy array
             Binarized threshold image as a numpy array
+        copy : bool, default = True
+            Pass a copy to cv2.findContours(). Set to False when threshold_image is a scratch buffer that
+            is overwritten before it is read again; OpenCV >= 3.2 does not modify the input anyway.
         Returns
         -------
         contours : list
@@ -210,11 +219,244 @@ def get_contours(threshold_image):
     """
     #assert len(set([0, 255]) - set(np.unique(threshold_image))) == 0, "image must be binarized to (0, 255)"
 
-    contours,_ = cv2.findContours(threshold_image.copy(), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    if copy:
+        threshold_image = threshold_image.copy()
+    contours,_ = cv2.findContours(threshold_image, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
 
     return contours
 
-def contour_loop(contours, image, dst, gray, maxSide, barcode_size, barcodes, flat_len, IDs, font,timeofframe, pt1, population):
+def get_local_mean(gray_image, block_size = 1001, dst = None):
+
+    """ Returns the local mean used by get_threshold() for every pixel of gray_image.
+        Parameters
+        ----------
+        gray_image : (MxNx1) numpy array
+            Single-channel grayscale image as a numpy array
+        block_size : int, default = 1001
+            Odd value integer. Size of the local neighborhood, in pixels of gray_image.
+        dst : (MxNx1) numpy array, default = None
+            Preallocated uint8 output buffer, a new array is allocated if None.
+        Returns
+        -------
+        mean_image : (MxNx1) numpy array
+            uint8 local mean, computed the same way as cv2.adaptiveThreshold() does internally.
+    """
+
+    assert block_size % 2 == 1, "block_size must be an odd value"
+
+    mean_image = cv2.boxFilter(gray_image, -1, (block_size, block_size), dst = dst, normalize = True,
+                               borderType = cv2.BORDER_REPLICATE | cv2.BORDER_ISOLATED)
+
+    return mean_image
+
+def threshold_from_mean(gray_image, mean_image, offset = 2, dst = None):
+
+    """ Returns binarized image equivalent to get_threshold() given a precomputed local mean.
+        Parameters
+        ----------
+        gray_image : (MxNx1) numpy array
+            Single-channel grayscale image as a numpy array
+        mean_image : (MxNx1) numpy array
+            Local mean of the same shape as gray_image, see get_local_mean().
+        offset : default = 2
+            Constant subtracted from the mean.
+        dst : (MxNx1) numpy array, default = None
+            Preallocated uint8 output buffer, a new array is allocated if None.
+        Returns
+        -------
+        threshold_image : (MxNx1) numpy array
+            Binarized (0, 255) image as a numpy array.
+    """
+
+    # same rule as cv2.ADAPTIVE_THRESH_MEAN_C: src - mean > -offset
+    threshold_image = cv2.compare(gray_image.astype(np.int16), mean_image.astype(np.int16) - offset, cv2.CMP_GT, dst = dst)
+
+    return threshold_image
+
+def get_candidate_regions(threshold_image, scale, margin = 24, lower_size_limit = 70, upper_size_limit = 400, slack = 2.0, mask = None):
+
+    """ Returns full-resolution regions that may contain a tag, from a threshold of a downscaled pyramid level.
+        Parameters
+        ----------
+        threshold_image : (MxNx1) numpy array
+            Binarized threshold image of the downscaled pyramid level.
+        scale : int
+            Downscaling factor of threshold_image relative to full resolution (2**levels).
+        margin : int, default = 24
+            Padding in full-resolution pixels added around every candidate blob.
+        lower_size_limit, upper_size_limit : int, default = 70, 400
+            Tag area limits in full-resolution pixels, as used in contour_loop().
+        slack : float, default = 2.0
+            Factor by which the area limits are widened, since small blobs are distorted by downscaling.
+        mask : (MxNx1) numpy array, default = None
+            Preallocated uint8 scratch buffer of the same shape as threshold_image.
+        Returns
+        -------
+        regions : list of ((x1, y1), (x2, y2))
+            Non-overlapping full-resolution rectangles, with corners aligned to multiples of scale.
+    """
+
+    small_shape = threshold_image.shape
+    min_area = lower_size_limit / float(scale**2) / slack
+    max_area = upper_size_limit / float(scale**2) * slack
+    pad = int(np.ceil(margin / float(scale)))
+
+    contours,_ = cv2.findContours(threshold_image, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+    # draw the padded boxes of tag-sized blobs so that overlapping boxes merge into one region
+    if mask is None:
+        mask = np.zeros(small_shape, dtype = np.uint8)
+    else:
+        mask[:] = 0
+    for cnt in contours:
+        if cnt.shape[0] > 50:
+            continue
+        x, y, w, h = cv2.boundingRect(cnt)
+        box_area = w * h
+        if min_area <= box_area and abs(cv2.contourArea(cnt)) <= max_area:
+            cv2.rectangle(mask, (x - pad, y - pad), (x + w + pad, y + h + pad), 255, -1)
+
+    merged,_ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    regions = []
+    for cnt in merged:
+        x, y, w, h = cv2.boundingRect(cnt)
+        regions.append(((x*scale, y*scale), ((x + w)*scale, (y + h)*scale)))
+
+    return regions
+
+def get_roi_mask(roi, resize_param, frame_shape):
+
+    """ Returns a mask of the regions of interest of a camera, 255 inside a region and 0 elsewhere.
+        Parameters
+        ----------
+        roi : list of list of [x, y]
+            Regions in camera pixels, i.e. before resizing. A region of two points is the rectangle with
+            these opposite corners, a region of three or more points is a polygon with these vertices.
+        resize_param : float
+            Resize applied to the frames, scales the region coordinates.
+        frame_shape : tuple of int
+            Shape of the resized frame.
+        Returns
+        -------
+        roi_mask : (MxNx1) numpy array
+            uint8 mask of the frame size.
+    """
+
+    roi_mask = np.zeros(frame_shape[:2], dtype = np.uint8)
+    for region in roi:
+        points = np.round(np.asarray(region, dtype = np.float64) * resize_param).astype(np.int32)
+        if len(points) == 2:
+            cv2.rectangle(roi_mask, tuple(points[0].tolist()), tuple(points[1].tolist()), 255, -1)
+        else:
+            cv2.fillPoly(roi_mask, [points], 255)
+
+    return roi_mask
+
+def get_roi_regions(roi_mask):
+
+    """ Returns the bounding rectangles ((x1, y1), (x2, y2)) of the separate parts of roi_mask, overlapping regions merged """
+
+    contours,_ = cv2.findContours(roi_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    regions = []
+    for cnt in contours:
+        x, y, w, h = cv2.boundingRect(cnt)
+        regions.append(((x, y), (x + w, y + h)))
+
+    return sorted(regions)
+
+def pack_bits(bits):
+
+    """ Returns the 0/1 values of bits, flattened row-major, packed into one integer (first bit highest) """
+
+    code = 0
+    for bit in np.asarray(bits).flatten():
+        code = (code << 1) | int(bit)
+    return code
+
+def build_code_table(codes, max_errors = 1):
+
+    """ Returns a lookup table from every bit pattern within max_errors bit flips of a code to its row index.
+        Parameters
+        ----------
+        codes : 2-D array_like
+            Rows of 0/1 tag bits without border, one row per tag rotation, in the same order as the
+            correlation barcodes so the row index gives both ID and rotation.
+        max_errors : int, default = 1
+            Number of bit errors corrected. Must stay below half of the minimum Hamming distance
+            (TagList.ndiffs) for lookups to be unique; the table has len(codes)*sum(C(n_bits, k), k <= max_errors)
+            entries, about 260,000 for 200 tags (800 rotations) with 25 bits and max_errors = 2.
+        Returns
+        -------
+        code_table : dict
+            Maps packed bit patterns (see pack_bits) to row indices. Patterns reachable from two rows are
+            mapped to -1 and left to the correlation fallback.
+    """
+
+    codes = np.asarray(codes)
+    n_bits = codes.shape[1]
+    flips = [0]
+    for n_errors in range(1, max_errors + 1):
+        for positions in itertools.combinations(range(n_bits), n_errors):
+            flips.append(sum(1 << (n_bits - 1 - position) for position in positions))
+
+    code_table = {}
+    for index, code in enumerate(codes):
+        code = pack_bits(code)
+        for flip in flips:
+            key = code ^ flip
+            if code_table.get(key, index) != index:
+                code_table[key] = -1
+            else:
+                code_table[key] = index
+    return code_table
+
+code_tables = {} # build_code_table() results by (codes, max_errors), shared by all decode() calls
+
+def get_code_table(codes, max_errors = 1):
+
+    """ Returns build_code_table(codes, max_errors), building it only once per process """
+
+    codes = np.asarray(codes, dtype = np.uint8)
+    key = (codes.tobytes(), codes.shape, max_errors)
+    if key not in code_tables:
+        code_tables[key] = build_code_table(codes, max_errors)
+    return code_tables[key]
+
+def read_bits(resize_warp, border = 1, min_margin = 0.1):
+
+    """ Returns the packed interior bits of a sampled tag, or None if the patch is too ambiguous to binarize.
+        Parameters
+        ----------
+        resize_warp : 2-D numpy array
+            Tag sampled with one cell per pixel, including the white border.
+        border : int, default = 1
+            Width of the white border in cells.
+        min_margin : float, default = 0.1
+            Minimum distance of every cell from the threshold, as a fraction of the white-black contrast.
+        Returns
+        -------
+        code : int or None
+            Packed bits, white cells are 1.
+    """
+
+    patch = resize_warp.astype(np.float32)
+    interior = patch[border:-border, border:-border]
+    ring_mask = np.ones(patch.shape, dtype = bool)
+    ring_mask[border:-border, border:-border] = False
+
+    white = patch[ring_mask].mean()
+    black = interior.min()
+    contrast = white - black
+    if contrast <= 0:
+        return None
+    threshold = (white + black) / 2
+    if np.min(np.abs(interior - threshold)) < min_margin * contrast:
+        return None
+    return pack_bits(interior > threshold)
+
+def contour_loop(contours, image, dst, gray, maxSide, barcode_size, barcodes, flat_len, IDs, font,timeofframe, pt1, population, params = camera_profiles.default_params, code_table = None, tag_areas = None):
     # define frame edges for checking for tags
     edge_thresh = 1
     image_shape = image.shape
@@ -222,15 +464,19 @@ def contour_loop(contours, image, dst, gray, maxSide, barcode_size, barcodes, fl
     maxy_thresh = image_shape[0] - edge_thresh
     to_write_list = []
     detected_tags = []
-    #change these values to fit the size of barcode you want to detect
-    upper_size_limit = -400
-    lower_size_limit = -70
+    #size of barcode you want to detect, set per camera in camera_profiles
+    upper_size_limit = -params["upper_size_limit"]
+    lower_size_limit = -params["lower_size_limit"]
+    min_points = params["min_contour_points"]
+    max_points = params["max_contour_points"]
+    poly_epsilon = params["poly_epsilon"]
+    match_threshold = params["match_threshold"]
 
     for cnt in contours:
         #cv2.drawContours(image, [cnt], -1, (0,0,255), 1)
         cnt_shape = cnt.shape
 
-        if 4 <= cnt_shape[0] <= 50 : # only look at contours that could be tags
+        if min_points <= cnt_shape[0] <= max_points : # only look at contours that could be tags
 
             area = cv2.contourArea(cnt, True)
 
@@ -250,7 +496,7 @@ def contour_loop(contours, image, dst, gray, maxSide, barcode_size, barcodes, fl
 
                     # fit a polygon
                     peri_cnt = cv2.arcLength(cnt, True)
-                    approx = cv2.approxPolyDP(cnt, 0.1 * peri_cnt, True)
+                    approx = cv2.approxPolyDP(cnt, poly_epsilon * peri_cnt, True)
                     poly_area = cv2.contourArea(approx, True)
 
                     # check if it's approximately a parallelogram
@@ -272,13 +518,30 @@ def contour_loop(contours, image, dst, gray, maxSide, barcode_size, barcodes, fl
                             warped = cv2.warpPerspective(gray, M, (maxSide, maxSide), borderValue = 255 )
                             resize_warp = cv2.resize(warped, barcode_size, interpolation = cv2.INTER_AREA)
 
-                            # calculate best match with master_list
-                            correlation = corr2_coeff(barcodes, resize_warp.reshape((1,flat_len)))
-                            best_value = np.max(correlation)
+                            flat_warp = resize_warp.reshape((1,flat_len))
+                            best_index = None
+                            if code_table is not None:
+                                # fast path: look up the binarized bits, confirm with a single correlation
+                                code = read_bits(resize_warp, min_margin = params["hash_min_margin"])
+                                if code is not None:
+                                    best_index = code_table.get(code)
+                                if best_index is not None and best_index >= 0:
+                                    best_value = corr2_coeff(barcodes[best_index:best_index+1], flat_warp)[0, 0]
+                                    if not best_value > match_threshold:
+                                        best_index = None
+                                else:
+                                    # too close to the threshold to binarize, within reach of two tags, or more
+                                    # bit errors than the table holds, which can still correlate above match_threshold
+                                    best_index = None
+
+                            if best_index is None:
+                                # calculate best match with master_list
+                                correlation = corr2_coeff(barcodes, flat_warp)
+                                best_value = np.max(correlation)
+                                best_index = np.argmax(correlation)
 
-                            if best_value > 0.8: #check for prob of match
+                            if best_value > match_threshold: #check for prob of match
                                 print(poly_area)
-                                best_index = np.argmax(correlation)
                                 ID = IDs[best_index]
                                 centroid = np.array(pts.mean(0))
                                 y_offset = 0
@@ -313,9 +576,11 @@ def contour_loop(contours, image, dst, gray, maxSide, barcode_size, barcodes, fl
                                 cv2.putText(image,str(ID),mid_centroid, font, font_scale,(255,255,255),inline_font,cv2.LINE_AA)
 
                                 #write to data file
-                                to_write_line = "{},{},{},{},{},{},{}\n".format(population,timeofframe ,ID, best_value, (centroid[0]+pt1[0]), (centroid[1]+pt1[1]), vector_angle )
+                                to_write_line = "{},{},{},{},{},{},{}\n".format(population,timeofframe ,ID, best_value, (centroid[0]+pt1[0]), (centroid[1]-pt1[1]), vector_angle )
                                 to_write_list.append(to_write_line)
                                 detected_tags.append(ID)
+                                if tag_areas is not None:
+                                    tag_areas.append(-poly_area)
 
     num_detections = len(to_write_list)
 
@@ -325,17 +590,89 @@ def contour_loop(contours, image, dst, gray, maxSide, barcode_size, barcodes, fl
 
 
 
+class FrameBuffers:
+
+    """Preallocated working buffers for the per-image pipeline in decode().
+
+        Every frame of a folder has the same size, so the resized frame, its green channel, the blurred
+        image, the threshold image and the pyramid levels are written into these arrays through OpenCV
+        dst= outputs instead of being allocated per image and per offset. Buffers are only reallocated
+        when the frame shape changes, so one FrameBuffers can be reused across folders.
+
+        Peak memory per worker is bounded by the decoded JPEG (3 bytes per camera pixel, allocated by
+        cv2.imread) plus nbytes. For a 12 MP (4000x3000) camera at resize_param 0.8 that is
+        36 MB + 23 MB (frame) + 3 x 7.7 MB (gray, blur, threshold) + ~4 MB (pyramid level 1), about 86 MB,
+        against several hundred MB of short-lived allocations per image without the pool.
+
+        Parameters
+        ----------
+        pyramid_levels : int, default = 0
+            Number of pyramid levels to allocate for the coarse-to-fine search.
+
+        """
+
+    def __init__(self, pyramid_levels = 0):
+
+        self.pyramid_levels = pyramid_levels
+        self.shape = None
+
+    def ensure(self, frame_shape):
+
+        """Allocate buffers for frames of frame_shape (height, width) unless they already exist."""
+
+        frame_shape = tuple(frame_shape[:2])
+        if frame_shape == self.shape:
+            return
+
+        height, width = frame_shape
+        self.shape = frame_shape
+        self.frame = np.empty((height, width, 3), dtype = np.uint8)
+        self.gray = np.empty((height, width), dtype = np.uint8)
+        self.blur = np.empty((height, width), dtype = np.uint8)
+        self.thresh = np.empty((height, width), dtype = np.uint8)
+
+        self.levels = []
+        for level in range(self.pyramid_levels):
+            height, width = (height + 1) // 2, (width + 1) // 2
+            self.levels.append(np.empty((height, width), dtype = np.uint8))
+        if self.pyramid_levels > 0:
+            self.small_mean = np.empty((height, width), dtype = np.uint8)
+            self.small_thresh = np.empty((height, width), dtype = np.uint8)
+            self.small_mask = np.empty((height, width), dtype = np.uint8)
+
+    @property
+    def nbytes(self):
+
+        """Total size of the allocated buffers in bytes."""
+
+        if self.shape is None:
+            return 0
+        buffers = [self.frame, self.gray, self.blur, self.thresh] + self.levels
+        if self.pyramid_levels > 0:
+            buffers += [self.small_mean, self.small_thresh, self.small_mask]
+        return sum(buffer.nbytes for buffer in buffers)
+
+    def read(self, image_path, resize_param):
+
+        """Read image_path and resize it into the frame buffer. Returns the frame buffer."""
+
+        image = cv2.imread(image_path)
+        frame_shape = (int(round(image.shape[0]*resize_param)), int(round(image.shape[1]*resize_param)))
+        self.ensure(frame_shape)
+        cv2.resize(image, (frame_shape[1], frame_shape[0]), dst = self.frame)
+        return self.frame
+
+
 def write_csv(to_write, data_filepath):
     with open(data_filepath, "a") as savefile: # open data file in write mode
         # write column names to file
         savefile.write(to_write)
 
 
-#decode() iterates through photos within a directory and writes information related to ID and position into a spreadsheet
-def decode(image_dir,data_filepath,tags,target_pop):
-    master_list = tags.master_list
-    IDs = tags.id_list
-    zipped_list = list(zip(IDs, master_list))
+def approved_ids(target_pop):
+
+    """ Returns the list of tag IDs deployed in population target_pop """
+
     if target_pop=="P1":
         approved_list = [4,14,24]
     elif target_pop=="P2":
@@ -361,6 +698,23 @@ def decode(image_dir,data_filepath,tags,target_pop):
     elif target_pop=="P12":
         approved_list = list(range(1, 201))
 
+    return approved_list
+
+
+#decode() iterates through photos within a directory and writes information related to ID and position into a spreadsheet
+#pyramid_levels > 0 first searches a downscaled copy of each frame and only runs contour_loop() on crops around tag-sized blobs
+#buffers is an optional FrameBuffers to reuse across calls
+#params are the detection parameters, by default the camera profile of image_dir (see camera_profiles.py)
+#status is an optional worker_status.WorkerStatus counting processed images
+#tag_areas is an optional list that receives the pixel area of every written detection
+def decode(image_dir,data_filepath,tags,target_pop,pyramid_levels=None,buffers=None,params=None,status=None,tag_areas=None):
+    master_list = tags.master_list
+    IDs = tags.id_list
+    zipped_list = list(zip(IDs, master_list))
+    approved_list = approved_ids(target_pop)
+    if params is None:
+        params = camera_profiles.load_profile(image_dir)
+
     IDs = [id[0] for id in zipped_list if id[0] in approved_list]
     barcode_size = (7,7)
     barcodes = []
@@ -374,6 +728,11 @@ def decode(image_dir,data_filepath,tags,target_pop):
     barcodes = np.array(barcodes)
     assert len(barcodes)==len(IDs), "id list does not equal barcode list"
 
+    if params["decoding"] == "hash":
+        code_table = get_code_table([bits for ID, bits in zipped_list if ID in approved_list], params["hash_max_errors"])
+    else:
+        code_table = None
+
     # set various parameters for tracker subroutines
     flat_len = barcode_size[0]*barcode_size[1]
     maxSide = 100
@@ -393,31 +752,89 @@ def decode(image_dir,data_filepath,tags,target_pop):
     images_to_process = sorted(images_to_process, key=str.lower, reverse=False)
     print("processing {} images".format(len(images_to_process)))
     
+    if pyramid_levels is None:
+        pyramid_levels = params["pyramid_levels"]
+
+    resize_param = params["resize_param"]
+    if resize_param is None:
+        resize_param = camera_profiles.default_resize_param(image_dir)
     if "Feeder" in image_dir:
-        print("feeder folder, resize less")
-        resize_param = 0.9
-    else:
-        resize_param = 0.8
+        print("feeder folder, resize {}".format(resize_param))
     
+    if buffers is None:
+        buffers = FrameBuffers(pyramid_levels)
+    elif buffers.pyramid_levels != pyramid_levels:
+        buffers.pyramid_levels = pyramid_levels
+        buffers.shape = None # reallocate on the next frame
+
+    roi = params["roi"]
+    roi_shape = None
+
     for image_path in images_to_process:
-        image = cv2.imread(image_path)
-        image = cv2.resize(image, (0,0), fx=resize_param, fy=resize_param) 
+        image = buffers.read(image_path, resize_param)
+        if roi is not None and image.shape[:2] != roi_shape:
+            # only threshold and contour inside the regions of interest
+            roi_shape = image.shape[:2]
+            roi_mask = get_roi_mask(roi, resize_param, roi_shape)
+            roi_regions = get_roi_regions(roi_mask)
+            if pyramid_levels > 0:
+                small_roi_mask = cv2.resize(roi_mask, buffers.levels[-1].shape[::-1], interpolation = cv2.INTER_AREA)
+                small_roi_mask = cv2.compare(small_roi_mask, 0, cv2.CMP_GT)
         frame_width, frame_height, channels = image.shape
         pt1 = (0,0) #top-left corner
         pt2 = (frame_width,frame_height) #bottom-right corner
         timeofframe = re.search("\d\d\d\d-\d\d-\d\d-\d\d-\d\d-\d\d-\d\d\d\d\d\d",image_path).group(0)
         timeofframe = dt.datetime.strptime(timeofframe, "%Y-%m-%d-%H-%M-%S-%f")
-        gray = get_grayscale(image, channel = 'green')
-        gray = cv2.GaussianBlur(gray, (1,1), 1)
+        gray = get_grayscale(image, channel = 'green', dst = buffers.gray)
+        gray = cv2.GaussianBlur(gray, (1,1), 1, dst = buffers.blur)
         
-        offset_values = [-70,-50,-30,-10,0,2]
+        block_size = params["block_size"]
+        if pyramid_levels > 0:
+            scale = 2**pyramid_levels
+            small = gray
+            for level in range(pyramid_levels):
+                small = cv2.pyrDown(small, dst = buffers.levels[level], dstsize = buffers.levels[level].shape[::-1])
+            small_mean = get_local_mean(small, block_size = max(3, (block_size // scale) | 1), dst = buffers.small_mean)
+
+        offset_values = params["offset_values"]
         for offset_v in offset_values:
             #print(offset_v)
-            thresh = get_threshold(gray, block_size = 1001, offset = offset_v)
-            contours = get_contours(thresh)
-
-            #this begins to loop through the detected contours
-            to_write, detected_tags, num_detections = contour_loop(contours, image, dst, gray, maxSide, barcode_size, barcodes,flat_len, IDs, font, timeofframe, pt1, target_pop)
+            if pyramid_levels > 0 or roi is not None:
+                if pyramid_levels > 0:
+                    # coarse pass: tag-sized blobs on the downscaled level
+                    small_thresh = threshold_from_mean(small, small_mean, offset = offset_v, dst = buffers.small_thresh)
+                    if roi is not None:
+                        cv2.bitwise_and(small_thresh, small_roi_mask, dst = small_thresh)
+                    regions = get_candidate_regions(small_thresh, scale, lower_size_limit = params["lower_size_limit"], upper_size_limit = params["upper_size_limit"], mask = buffers.small_mask)
+                else:
+                    regions = roi_regions
+
+                # fine pass: full-resolution contour_loop() on crops around the candidates or regions of interest only
+                to_write_list = []
+                detected_tags = []
+                for region_pt1, region_pt2 in regions:
+                    gray_crop = crop(gray, region_pt1, region_pt2)
+                    if pyramid_levels > 0:
+                        mean_crop = crop(small_mean, (region_pt1[0]//scale, region_pt1[1]//scale), (region_pt2[0]//scale, region_pt2[1]//scale))
+                        mean_crop = cv2.resize(mean_crop, (gray_crop.shape[1], gray_crop.shape[0]), interpolation = cv2.INTER_LINEAR)
+                        thresh = threshold_from_mean(gray_crop, mean_crop, offset = offset_v)
+                    else:
+                        thresh = get_threshold(gray_crop, block_size = block_size, offset = offset_v)
+                    if roi is not None:
+                        # polygons: drop everything outside the region within its bounding rectangle
+                        cv2.bitwise_and(thresh, crop(roi_mask, region_pt1, region_pt2), dst = thresh)
+                    contours = get_contours(thresh, copy = False)
+                    region_write, region_tags, _ = contour_loop(contours, crop(image, region_pt1, region_pt2), dst, gray_crop, maxSide, barcode_size, barcodes,flat_len, IDs, font, timeofframe, region_pt1, target_pop, params, code_table, tag_areas)
+                    to_write_list.append(region_write)
+                    detected_tags.extend(region_tags)
+                to_write = "".join(to_write_list)
+                num_detections = len(detected_tags)
+            else:
+                thresh = get_threshold(gray, block_size = block_size, offset = offset_v, dst = buffers.thresh)
+                contours = get_contours(thresh, copy = False)
+
+                #this begins to loop through the detected contours
+                to_write, detected_tags, num_detections = contour_loop(contours, image, dst, gray, maxSide, barcode_size, barcodes,flat_len, IDs, font, timeofframe, pt1, target_pop, params, code_table, tag_areas)
             #print()
             #cv2.imshow("preview",image)
             if num_detections > 0:
@@ -425,6 +842,9 @@ def decode(image_dir,data_filepath,tags,target_pop):
                 write_csv(to_write, data_filepath)
                 break
 
+        if status is not None:
+            status.image_done()
+
         k = cv2.waitKey(1)
         if k == ord('q'):
             break
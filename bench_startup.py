@@ -0,0 +1,76 @@
+""" Cold start time of the decoding entry points.
+
+Usage: python3 bench_startup.py [repeats] [--limit 1.0]
+
+Times fresh interpreters doing nothing, importing the tracker, and starting pinpoint_worker.py up to
+the point where it would accept its first job (imports plus master list). The worker is started with
+an empty stdin so it exits right after loading. Exits with status 1 if the worker's median cold start
+exceeds --limit seconds. The slowest imports of the worker are listed from ``python -X importtime``.
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+import tempfile
+
+commands = [
+    ("interpreter", [sys.executable, "-c", "pass"]),
+    ("import tracker", [sys.executable, "-c", "import barcode_tracker_photos_modified"]),
+    ("tracker + tags", [sys.executable, "-c", "import TagList, barcode_tracker_photos_modified; TagList.TagList().load('master_list_outdoor.pkl')"]),
+]
+
+
+def time_command(command, repeats, stdin = subprocess.DEVNULL):
+
+    """ Returns the wall time in seconds of each of repeats runs of command """
+
+    times = []
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        subprocess.run(command, stdin = stdin, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, check = True)
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def slowest_imports(command, n = 10):
+
+    """ Returns the n slowest (cumulative microseconds, module) imports of command """
+
+    result = subprocess.run([sys.executable, "-X", "importtime"] + command[1:], stdin = subprocess.DEVNULL,
+                            stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, universal_newlines = True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            fields = line[len("import time:"):].split("|")
+            if fields[1].strip().isdigit():
+                # only top-level imports, their cumulative time includes the children
+                if not fields[2].startswith("  "):
+                    imports.append((int(fields[1]), fields[2].strip()))
+    return sorted(imports, reverse = True)[:n]
+
+
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(description = "Measure the cold start of the decoding entry points.")
+    parser.add_argument("repeats", nargs = "?", type = int, default = 5)
+    parser.add_argument("--limit", type = float, default = 1.0, help = "maximum median cold start of the worker in seconds")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        worker = [sys.executable, "pinpoint_worker.py", "--data-dir", os.path.join(tmp_dir, "data"),
+                  "--processed-dir", os.path.join(tmp_dir, "processed")]
+        medians = {}
+        for name, command in commands + [("pinpoint_worker", worker)]:
+            times = sorted(time_command(command, args.repeats))
+            medians[name] = times[len(times) // 2]
+            print("{:<16} median {:.3f} s  min {:.3f} s  max {:.3f} s".format(name, medians[name], times[0], times[-1]))
+
+        print("\nslowest imports of pinpoint_worker (cumulative):")
+        for microseconds, module in slowest_imports(worker):
+            print("{:>8.1f} ms  {}".format(microseconds/1000.0, module))
+
+    if medians["pinpoint_worker"] > args.limit:
+        print("\nworker cold start {:.3f} s exceeds the limit of {} s".format(medians["pinpoint_worker"], args.limit))
+        sys.exit(1)
@@ -0,0 +1,92 @@
+""" Benchmark the coarse-to-fine pyramid search in decode() against the full-resolution search.
+
+Usage: python3 benchmark_pyramid.py <image_dir> <population> [levels ...]
+
+Runs decode() over the same folder once with the full search and once per pyramid level,
+then reports time per image and the recall of the pyramid search relative to the full search.
+The full search stays the default; once a camera's real folders show recall parity, enable the
+pyramid for that camera only with ``"pyramid_levels": 1`` in ``camera_profiles/<camera>.json``.
+"""
+
+import os
+import time
+import tempfile
+from os.path import join
+from sys import argv
+
+import numpy as np
+import TagList
+from barcode_tracker_photos_modified import decode
+
+header = "population,time,id,id_prob,x,y,orientation\n"
+
+
+def read_detections(data_filepath):
+
+    """ Returns a dict mapping (time, id) to a list of (x, y) positions from a decode() output file """
+
+    detections = {}
+    with open(data_filepath) as data_file:
+        next(data_file)
+        for line in data_file:
+            population, timeofframe, ID, id_prob, x, y, orientation = line.strip().split(",")
+            detections.setdefault((timeofframe, ID), []).append((float(x), float(y)))
+    return detections
+
+
+def match_detections(reference, candidate, max_distance = 5.0):
+
+    """ Returns the number of reference detections also found in candidate within max_distance pixels """
+
+    matched = 0
+    for key, positions in reference.items():
+        remaining = list(candidate.get(key, []))
+        for position in positions:
+            if len(remaining) == 0:
+                break
+            distances = [np.hypot(position[0]-x, position[1]-y) for x, y in remaining]
+            best = int(np.argmin(distances))
+            if distances[best] <= max_distance:
+                matched += 1
+                remaining.pop(best)
+    return matched
+
+
+def run_decode(image_dir, tags, population, pyramid_levels, output_dir):
+    data_filepath = join(output_dir, "pyramid_{}.csv".format(pyramid_levels))
+    with open(data_filepath, "w") as savefile:
+        savefile.write(header)
+    t0 = time.time()
+    decode(image_dir, data_filepath, tags, population, pyramid_levels = pyramid_levels)
+    t1 = time.time()
+    return read_detections(data_filepath), t1 - t0
+
+
+if __name__=="__main__":
+
+    image_dir = argv[1]
+    population = argv[2]
+    levels = [int(level) for level in argv[3:]] or [1, 2]
+
+    tags = TagList.TagList()
+    tags.load("master_list_outdoor.pkl")
+    n_images = len([f for f in os.listdir(image_dir) if os.path.isfile(join(image_dir, f))])
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        reference, reference_time = run_decode(image_dir, tags, population, 0, output_dir)
+        n_reference = sum(len(positions) for positions in reference.values())
+
+        results = []
+        for pyramid_levels in levels:
+            detections, elapsed = run_decode(image_dir, tags, population, pyramid_levels, output_dir)
+            n_detections = sum(len(positions) for positions in detections.values())
+            matched = match_detections(reference, detections)
+            results.append((pyramid_levels, elapsed, n_detections, matched))
+
+    print("")
+    print("{} images, {} detections with the full search".format(n_images, n_reference))
+    print("levels  s/image  speedup  detections  recall")
+    print("{:>6}  {:>7.3f}  {:>7.2f}  {:>10}  {:>6}".format("full", reference_time/max(n_images, 1), 1.0, n_reference, "-"))
+    for pyramid_levels, elapsed, n_detections, matched in results:
+        recall = matched/float(n_reference) if n_reference > 0 else float("nan")
+        print("{:>6}  {:>7.3f}  {:>7.2f}  {:>10}  {:>6.3f}".format(pyramid_levels, elapsed/max(n_images, 1), reference_time/max(elapsed, 1e-9), n_detections, recall))
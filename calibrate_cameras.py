@@ -0,0 +1,184 @@
+""" Pick the smallest working resolution for each camera from the size of its decoded tags.
+
+Usage: python3 calibrate_cameras.py P1 P2 ... [--server-path PATH] [--frames 200] [--dry-run]
+
+For every camera (population and camera type, e.g. P3_Feeder) a sample of frames is decoded at full
+resolution with wide area limits, recording the pixel area of every decoded tag. The resize is then
+chosen so that the smallest tags (5th percentile) keep at least --min-area pixels, the area limits are
+fitted around the observed sizes, and the setting is accepted once it finds --recall of the full
+resolution detections on the same sample. The result goes into camera_profiles/<camera>.json.
+"""
+
+import os
+import math
+import argparse
+import tempfile
+import contextlib
+from os.path import join, isfile, basename
+
+import numpy as np
+import camera_profiles
+from autotune import read_detection_counts, score
+from distributed_worker import list_folders
+
+header = "population,time,id,id_prob,x,y,orientation\n"
+reference_resize = 0.8 # resize the default block_size of 1001 was chosen for
+
+
+def sample_frames(folders, n_frames, rng):
+
+    """ Returns up to n_frames image paths drawn evenly from folders """
+
+    frames = []
+    folders = list(folders)
+    rng.shuffle(folders)
+    per_folder = max(1, int(math.ceil(n_frames / float(max(len(folders), 1)))))
+    for folder in folders:
+        images = sorted(f for f in os.listdir(folder) if isfile(join(folder, f)))
+        if len(images) > per_folder:
+            images = [images[i] for i in sorted(rng.choice(len(images), per_folder, replace = False))]
+        frames.extend(join(folder, image) for image in images)
+        if len(frames) >= n_frames:
+            break
+    return frames[:n_frames]
+
+
+def run_sample(sample_dir, tags, population, params):
+
+    """ Decodes sample_dir with params and returns (detection counts, tag areas) """
+
+    from barcode_tracker_photos_modified import decode
+
+    data_filepath = sample_dir.rstrip("/") + "_detections.csv"
+    with open(data_filepath, "w") as savefile:
+        savefile.write(header)
+    tag_areas = []
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        decode(sample_dir, data_filepath, tags, population, params = params, tag_areas = tag_areas)
+    detections = read_detection_counts(data_filepath)
+    os.remove(data_filepath)
+    return detections, np.array(tag_areas)
+
+
+def scaled_params(params, resize_param, areas, area_margin = 1.5):
+
+    """ Returns params for resize_param with area limits fitted around areas measured at full resolution """
+
+    params = dict(params)
+    params["resize_param"] = resize_param
+    scale = resize_param**2
+    params["lower_size_limit"] = int(max(10, math.floor(np.percentile(areas, 1) * scale / area_margin)))
+    params["upper_size_limit"] = int(math.ceil(np.percentile(areas, 99) * scale * area_margin))
+    params["block_size"] = int(round(camera_profiles.default_params["block_size"] * resize_param / reference_resize)) | 1
+    # contour points grow with the perimeter, the default of 50 was set for tags up to 400 pixels
+    default_upper = camera_profiles.default_params["upper_size_limit"]
+    params["max_contour_points"] = int(math.ceil(camera_profiles.default_params["max_contour_points"] *
+                                                 max(1.0, math.sqrt(params["upper_size_limit"] / float(default_upper)))))
+    return params
+
+
+def calibrate_camera(camera, folders, population, tags, n_frames = 200, min_area = 100, min_recall = 0.95,
+                     min_tags = 20, step = 0.05, seed = 0):
+
+    """Find the smallest resize of one camera that keeps its tags decodable.
+
+        Parameters
+        ----------
+        camera : str
+            Camera name, e.g. 'P3_Feeder'.
+        folders : list of str
+            Photo folders of the camera.
+        population : str
+            Population, selects the approved IDs.
+        tags : TagList
+            Loaded TagList.
+        n_frames : int, default = 200
+            Number of frames sampled across folders.
+        min_area : float, default = 100
+            Area in pixels that the 5th percentile tag must keep after resizing. contour_loop() accepts
+            tags from 70 pixels by default, the difference is headroom for tags smaller than the sample.
+        min_recall : float, default = 0.95
+            Fraction of the full resolution detections the chosen setting must still find.
+        min_tags : int, default = 20
+            Cameras with fewer decoded tags in the sample are not calibrated.
+        step : float, default = 0.05
+            Resize granularity.
+        seed : int, default = 0
+            Random seed of the frame sample.
+
+        Returns
+        -------
+        profile : dict or None
+            Profile entries for the camera, None if the sample had too few tags or even full
+            resolution missed min_recall.
+        """
+
+    rng = np.random.RandomState(seed)
+    frames = sample_frames(folders, n_frames, rng)
+    base = camera_profiles.load_profile(folders[0])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sample_dir = join(tmp_dir, camera)
+        os.makedirs(sample_dir)
+        for i, frame in enumerate(frames):
+            os.symlink(frame, join(sample_dir, "{:05d}_{}".format(i, basename(frame))))
+
+        # reference: full resolution, full search, wide limits
+        reference_params = dict(base, resize_param = 1.0, pyramid_levels = 0, lower_size_limit = 20,
+                                upper_size_limit = 20000, max_contour_points = 200,
+                                block_size = int(round(base["block_size"] / reference_resize)) | 1)
+        reference, areas = run_sample(sample_dir, tags, population, reference_params)
+        if len(areas) < min_tags:
+            print("{}: only {} tags decoded in {} frames, not calibrated".format(camera, len(areas), len(frames)))
+            return None
+
+        p5 = np.percentile(areas, 5)
+        resize_param = round(min(1.0, math.ceil(math.sqrt(min_area / p5) / step) * step), 2)
+        while True:
+            params = scaled_params(base, resize_param, areas)
+            detections, _ = run_sample(sample_dir, tags, population, params)
+            precision, recall = score(detections, reference)
+            print("{}: resize {:.2f} recall {:.3f}".format(camera, resize_param, recall))
+            if recall >= min_recall:
+                break
+            if resize_param >= 1.0:
+                print("{}: recall {:.3f} even at full resolution, not calibrated".format(camera, recall))
+                return None
+            resize_param = round(min(1.0, resize_param + step), 2)
+
+    profile = dict((key, params[key]) for key in ["resize_param", "lower_size_limit", "upper_size_limit", "block_size", "max_contour_points"])
+    profile["calibration"] = {"frames" : len(frames), "tags" : int(len(areas)),
+                              "tag_area_percentiles" : dict((str(q), float(np.percentile(areas, q))) for q in [1, 5, 50, 95, 99]),
+                              "recall" : recall, "precision" : precision}
+    return profile
+
+
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(description = "Calibrate the working resolution of each camera.")
+    parser.add_argument("populations", nargs = "+")
+    parser.add_argument("--server-path", default = "/mnt/Videos_GRETI/field_season_fall_2020/")
+    parser.add_argument("--frames", type = int, default = 200, help = "frames sampled per camera")
+    parser.add_argument("--min-area", type = float, default = 100, help = "pixel area the 5th percentile tag must keep")
+    parser.add_argument("--recall", type = float, default = 0.95)
+    parser.add_argument("--dry-run", action = "store_true", help = "report without saving profiles")
+    args = parser.parse_args()
+
+    import TagList
+    tags = TagList.TagList()
+    tags.load("master_list_outdoor.pkl")
+
+    cameras = {}
+    for population, folder in list_folders(args.server_path, args.populations):
+        camera = camera_profiles.camera_key(folder)
+        if camera is not None:
+            cameras.setdefault(camera, (population, []))[1].append(folder)
+
+    for camera in sorted(cameras):
+        population, folders = cameras[camera]
+        profile = calibrate_camera(camera, folders, population, tags, args.frames, args.min_area, args.recall)
+        if profile is None:
+            continue
+        print("{}: resize {resize_param}, area {lower_size_limit}-{upper_size_limit}, block {block_size}".format(camera, **profile))
+        if not args.dry_run:
+            print("saved {}".format(camera_profiles.save_profile(camera, profile)))
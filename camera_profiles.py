@@ -0,0 +1,109 @@
+""" Per-camera detection parameters for decode().
+
+A profile is a JSON file in profile_dir named after the camera, e.g. ``camera_profiles/P3_Feeder.json``,
+or after the camera type alone, e.g. ``camera_profiles/Feeder.json``, holding any subset of
+default_params. Missing keys keep their defaults.
+
+"roi" limits the search to the regions of a camera where a tag can actually be read, such as perches
+and feeder ports. Coordinates are pixels of the original photos, e.g. a rectangle and a polygon:
+
+    "roi" : [[[1200, 800], [2400, 1600]], [[300, 2000], [900, 1900], [1000, 2600], [250, 2700]]]
+"""
+
+import os
+import re
+import json
+from os.path import join, isfile
+
+profile_dir = "camera_profiles"
+camera_types = ["Feeder", "Social", "Puzzle"]
+
+# detection parameters used by decode() and contour_loop() when no profile overrides them
+default_params = {
+    "resize_param" : None, # None keeps the rule 0.9 for Feeder folders and 0.8 otherwise
+    "pyramid_levels" : 0, # full-resolution search; set 1 per camera once benchmark_pyramid.py shows recall parity on its real folders
+    "block_size" : 1001,
+    "offset_values" : [-70,-50,-30,-10,0,2],
+    "lower_size_limit" : 70, # tag area in pixels of the resized frame
+    "upper_size_limit" : 400,
+    "min_contour_points" : 4,
+    "max_contour_points" : 50,
+    "poly_epsilon" : 0.1, # approxPolyDP epsilon as a fraction of the contour perimeter
+    "match_threshold" : 0.8, # minimum correlation with the master list
+    "decoding" : "correlation", # "correlation" correlates with every tag; "hash" looks up the binarized bits first, set it per camera once regression_harness.py or benchmark_pyramid.py shows parity on its real frames
+    "hash_max_errors" : 2, # bit errors corrected by the lookup table
+    "hash_min_margin" : 0.1, # patches with a cell closer to the threshold than this fraction of the contrast are correlated
+    "roi" : None, # regions of interest in camera pixels, [[x1,y1],[x2,y2]] rectangles or [[x,y],...] polygons; None searches the whole frame
+}
+
+
+def camera_key(image_dir):
+
+    """ Returns the camera name of a photo folder, e.g. 'P3_Feeder', or None if it can't be told """
+
+    population = re.search(r"P\d?\d", image_dir)
+    camera_type = [t for t in camera_types if t in image_dir]
+    if population is None or len(camera_type) == 0:
+        return None
+    return "{}_{}".format(population.group(0), camera_type[0])
+
+
+def default_resize_param(image_dir):
+    if "Feeder" in image_dir:
+        return 0.9
+    return 0.8
+
+
+def load_profile(image_dir, profile_dir = profile_dir):
+
+    """Returns the detection parameters for the camera that took the photos in image_dir.
+
+        Parameters
+        ----------
+        image_dir : str
+            Photo folder, its path identifies the camera.
+        profile_dir : str, default = "camera_profiles"
+            Directory holding the profile JSON files.
+
+        Returns
+        -------
+        params : dict
+            default_params updated with the camera type profile and then the camera profile.
+        """
+
+    params = dict(default_params)
+    key = camera_key(image_dir)
+    if key is None:
+        return params
+
+    camera_type = key.split("_")[1]
+    for name in [camera_type, key]:
+        params.update(read_profile(name, profile_dir))
+    return params
+
+
+def read_profile(name, profile_dir = profile_dir):
+
+    """ Returns the entries stored in the profile called name, e.g. 'P3_Feeder' or 'Feeder', or {} if there is none """
+
+    profile_path = join(profile_dir, "{}.json".format(name))
+    if not isfile(profile_path):
+        return {}
+    with open(profile_path) as profile_file:
+        return json.load(profile_file)
+
+
+def save_profile(name, params, profile_dir = profile_dir):
+
+    """Write params as the profile called name, e.g. 'P3_Feeder' or 'Feeder'. Returns the file path.
+
+    Keys already in an existing profile that params does not set are kept.
+    """
+
+    os.makedirs(profile_dir, exist_ok = True)
+    profile_path = join(profile_dir, "{}.json".format(name))
+    profile = read_profile(name, profile_dir)
+    profile.update(params)
+    with open(profile_path, "w") as profile_file:
+        json.dump(profile, profile_file, indent = 4, sort_keys = True)
+    return profile_path
@@ -1,9 +1,26 @@
-from os.path import join
-import fileinput
-import sys
+""" Collate the per-folder detection files into one file per population and camera type.
+
+Usage: python3 concat_dataframes.py [--processes N] [--data-dir DIR] [--out-dir DIR]
+
+Files are read in parallel worker processes with an explicit schema (datetime time, categorical
+population, integer id, float32 id_prob, x, y and orientation) and appended to
+``<new_directory_path>/<population>_<camera>_full.csv`` one file at a time in name order, so memory
+stays bounded by a few per-folder files however long the season. Duplicate detections (population,
+time, id), left by folders that were decoded twice, are dropped within each file. Each output is
+written under a temporary name and only replaces the previous collation once complete.
+"""
+
+import os
 import re
-import pandas as pd
+import argparse
+import importlib.util
+from os.path import join
 from os import listdir
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
 
 directory_path = "/home/michael/pinpoint_exp2/data"
 new_directory_path = "/home/michael/pinpoint_exp2/coallated_data"
@@ -14,14 +31,131 @@ target_pops = ["P1","P2","P3","P4",
 
 types = ["Social","Feeder"]
 
-for camera_type in types:
-    for target_pop in target_pops:
-        print(camera_type + target_pop)
-        
-        df_list = [pd.read_csv(join(directory_path,f)) for f in listdir(directory_path) if
-        re.search("P\d?\d", f).group(0)==target_pop and camera_type in f]
-        
-        if len(df_list) > 0:
-            df_concat = pd.concat(df_list)
-            df_concat = df_concat.drop_duplicates(subset = ["population","time","id"],keep='first')
-            df_concat.to_csv(join(new_directory_path,"{}_{}_full.csv".format(target_pop, camera_type)), index = False)
+columns = ["population", "time", "id", "id_prob", "x", "y", "orientation"]
+schema = {"population" : "category", "id" : np.int32, "id_prob" : np.float32,
+          "x" : np.float32, "y" : np.float32, "orientation" : np.float32}
+
+# pandas imports pyarrow itself when the engine is used, so only check that it is installed
+csv_engine = "pyarrow" if importlib.util.find_spec("pyarrow") is not None else "c"
+
+
+def read_detection_file(data_filepath, usecols = None):
+
+    """Returns the detections of a decode() output or collated file with the collation schema.
+
+        Parameters
+        ----------
+        data_filepath : str
+            CSV file with the decode() columns.
+        usecols : list of str, default = None
+            Read only these columns.
+
+        Returns
+        -------
+        df : DataFrame
+            time as datetime64, population categorical, id int32, the other values float32. Rows with
+            a missing or unparsable value, such as a line cut off by a crashed worker, are dropped.
+        """
+
+    usecols = usecols or columns
+    dtype = dict((column, schema[column]) for column in usecols if column in schema)
+    try:
+        df = pd.read_csv(data_filepath, usecols = usecols, dtype = dtype, engine = csv_engine)
+    except ValueError:
+        # fall back to a lenient read and drop what does not parse
+        df = pd.read_csv(data_filepath, usecols = usecols, dtype = str, on_bad_lines = "skip")
+        for column in dtype:
+            if column != "population":
+                df[column] = pd.to_numeric(df[column], errors = "coerce")
+        df = df.dropna().astype(dtype)
+    df["time"] = pd.to_datetime(df["time"], format = "ISO8601", errors = "coerce")
+    # a short row reads as NaN in its missing float columns rather than failing the file
+    return df.dropna()
+
+
+def read_folder_file(data_filepath):
+
+    """ Returns the detections of one per-folder file without duplicates """
+
+    df = read_detection_file(data_filepath)
+    return df.drop_duplicates(subset = ["population", "time", "id"], keep = "first")
+
+
+def collation_groups(directory_path, target_pops, types):
+
+    """ Returns a dict mapping (population, camera type) to its finished ``*_pinpoint.csv`` files, sorted by name """
+
+    groups = dict(((target_pop, camera_type), []) for camera_type in types for target_pop in target_pops)
+    for f in sorted(listdir(directory_path)):
+        # skips the .partial shards distributed_worker.py is still writing
+        if not f.endswith("_pinpoint.csv"):
+            continue
+        population = re.search(r"P\d?\d", f)
+        if population is None:
+            continue
+        for camera_type in types:
+            if camera_type in f and (population.group(0), camera_type) in groups:
+                groups[(population.group(0), camera_type)].append(join(directory_path, f))
+    return groups
+
+
+def collate(file_paths, output_filepath, executor, window = 32):
+
+    """Append the detections of file_paths to output_filepath in order, reading them in executor.
+
+        Parameters
+        ----------
+        file_paths : list of str
+            Per-folder files, written in this order.
+        output_filepath : str
+            Collated file, replaced when all files are written.
+        executor : concurrent.futures.Executor
+            Pool reading the files.
+        window : int, default = 32
+            Files read ahead of the writer, bounds the memory held in finished but unwritten reads.
+
+        Returns
+        -------
+        n_rows : int
+            Number of detections written.
+        """
+
+    tmp_filepath = output_filepath + ".tmp"
+    n_rows = 0
+    header = True
+    pending = deque()
+    paths = iter(file_paths)
+    with open(tmp_filepath, "w", newline = "") as out_file:
+        while True:
+            while len(pending) < window:
+                path = next(paths, None)
+                if path is None:
+                    break
+                pending.append(executor.submit(read_folder_file, path))
+            if len(pending) == 0:
+                break
+            df = pending.popleft().result()
+            df.to_csv(out_file, header = header, index = False)
+            header = False
+            n_rows += len(df)
+    os.replace(tmp_filepath, output_filepath)
+    return n_rows
+
+
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(description = "Collate per-folder detections per population and camera type.")
+    parser.add_argument("--processes", type = int, default = None, help = "reader processes, defaults to the number of cores")
+    parser.add_argument("--data-dir", default = directory_path)
+    parser.add_argument("--out-dir", default = new_directory_path)
+    args = parser.parse_args()
+
+    groups = collation_groups(args.data_dir, target_pops, types)
+    with ProcessPoolExecutor(args.processes) as executor:
+        for camera_type in types:
+            for target_pop in target_pops:
+                print(camera_type + target_pop)
+                file_paths = groups[(target_pop, camera_type)]
+                if len(file_paths) > 0:
+                    n_rows = collate(file_paths, join(args.out_dir, "{}_{}_full.csv".format(target_pop, camera_type)), executor)
+                    print("{} detections from {} files".format(n_rows, len(file_paths)))
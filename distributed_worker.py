@@ -0,0 +1,424 @@
+""" Distributed processing of the photo backlog over the shared filesystem.
+
+Any number of hosts can run this script against the same server_path and lease directory.
+Each folder is claimed through a lease file created with O_CREAT|O_EXCL in the lease directory,
+so exactly one worker holds it. The holder touches its lease every heartbeat_interval seconds;
+a lease whose heartbeat is older than lease_ttl seconds belongs to a crashed worker and is
+reclaimed by the next worker that reaches the folder. Finished folders get a ``.done`` marker.
+A folder whose decoding raises gets a ``.failed`` marker holding the traceback instead, is logged
+and skipped by every worker, so one unreadable folder does not stop the hosts one after another;
+delete the marker to have it retried.
+
+Every worker writes its detections to its own shard file in the staging directory
+``<data_dir_csv>/.staging`` and only renames it to the usual ``<folder>_pinpoint.csv`` name in
+data_dir_csv once the folder is finished, so a crashed or reclaimed folder never leaves a
+half-written or doubly-written CSV behind. Shards of failed folders are deleted right away, and
+shards abandoned by killed workers are removed once they are older than lease_ttl.
+
+Usage: python3 distributed_worker.py --lease-dir /mnt/Videos_GRETI/leases P1 P2 P3
+"""
+
+import os
+import re
+import time
+import socket
+import traceback
+import hashlib
+import argparse
+import threading
+from os.path import isfile, isdir, join
+
+import worker_status
+from worker_status import WorkerStatus
+
+header = "population,time,id,id_prob,x,y,orientation\n"
+
+
+def lease_name(folder):
+
+    """ Returns the file name stem used for the lease and the done and failed markers of folder """
+
+    return hashlib.sha1(folder.encode("utf-8")).hexdigest()
+
+
+class LeaseDirectory:
+
+    """Claims folders through lease files in a directory shared by all workers.
+
+        Parameters
+        ----------
+        lease_dir : str
+            Directory on the shared filesystem, created if it does not exist.
+        worker_id : str
+            Unique name of this worker, written into every lease it holds.
+        lease_ttl : float, default = 600
+            Seconds without a heartbeat after which a lease is considered abandoned.
+
+        """
+
+    def __init__(self, lease_dir, worker_id, lease_ttl = 600):
+
+        self.lease_dir = lease_dir
+        self.worker_id = worker_id
+        self.lease_ttl = lease_ttl
+        os.makedirs(lease_dir, exist_ok = True)
+
+    def lease_path(self, folder):
+        return join(self.lease_dir, lease_name(folder) + ".lease")
+
+    def done_path(self, folder):
+        return join(self.lease_dir, lease_name(folder) + ".done")
+
+    def failed_path(self, folder):
+        return join(self.lease_dir, lease_name(folder) + ".failed")
+
+    def now(self):
+
+        """Returns the current time as seen by the shared filesystem.
+
+        Lease ages are compared against this rather than the local clock, so hosts with
+        skewed clocks still agree on which leases have expired.
+        """
+
+        # one probe file per host, shared by its workers, so runs don't leave files behind
+        clock_path = join(self.lease_dir, "{}.clock".format(socket.gethostname()))
+        with open(clock_path, "a"):
+            os.utime(clock_path, None)
+        return os.stat(clock_path).st_mtime
+
+    def is_done(self, folder):
+        return isfile(self.done_path(folder))
+
+    def is_failed(self, folder):
+        return isfile(self.failed_path(folder))
+
+    def claim(self, folder):
+
+        """Try to take the lease on folder.
+
+        Returns
+        -------
+        claimed : bool
+            True if this worker now holds the lease.
+        """
+
+        if self.is_done(folder) or self.is_failed(folder):
+            return False
+
+        lease_path = self.lease_path(folder)
+        for attempt in range(2):
+            try:
+                fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if attempt == 0 and self.break_if_expired(lease_path):
+                    continue
+                return False
+            with os.fdopen(fd, "w") as lease_file:
+                lease_file.write("{}\n{}\n".format(self.worker_id, folder))
+            # a worker that reclaimed an expired lease may have finished meanwhile
+            if self.is_done(folder):
+                self.release(folder)
+                return False
+            return True
+        return False
+
+    def break_if_expired(self, lease_path):
+
+        """Remove lease_path if its heartbeat is older than lease_ttl. Returns True if it was removed."""
+
+        try:
+            age = self.now() - os.stat(lease_path).st_mtime
+        except FileNotFoundError:
+            return True
+        if age <= self.lease_ttl:
+            return False
+
+        # rename first, so only one of several workers racing for the same stale lease breaks it
+        stale_path = "{}.stale.{}".format(lease_path, self.worker_id)
+        try:
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            return True
+        os.remove(stale_path)
+        print("reclaimed expired lease {} ({:.0f} s without heartbeat)".format(os.path.basename(lease_path), age))
+        return True
+
+    def holds(self, folder):
+
+        """Returns True if the lease on folder still names this worker."""
+
+        try:
+            with open(self.lease_path(folder)) as lease_file:
+                return lease_file.readline().strip() == self.worker_id
+        except FileNotFoundError:
+            return False
+
+    def heartbeat(self, folder):
+        os.utime(self.lease_path(folder), None)
+
+    def release(self, folder):
+        try:
+            os.remove(self.lease_path(folder))
+        except FileNotFoundError:
+            pass
+
+    def mark_done(self, folder):
+        with open(self.done_path(folder), "w") as done_file:
+            done_file.write("{}\n{}\n".format(self.worker_id, folder))
+        self.release(folder)
+
+    def mark_failed(self, folder, message):
+        with open(self.failed_path(folder), "w") as failed_file:
+            failed_file.write("{}\n{}\n{}".format(self.worker_id, folder, message))
+        self.release(folder)
+
+
+class Heartbeat(threading.Thread):
+
+    """Background thread that keeps a lease, and the shard being written, alive while a folder is being decoded."""
+
+    def __init__(self, leases, folder, interval = 30, shard_filepath = None):
+
+        threading.Thread.__init__(self, daemon = True)
+        self.leases = leases
+        self.folder = folder
+        self.shard_filepath = shard_filepath
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if not self.leases.holds(self.folder):
+                self.lost = True
+                print("lost lease on {}".format(self.folder))
+                return
+            self.leases.heartbeat(self.folder)
+            if self.shard_filepath is not None:
+                # decode() only writes on detections, so an empty stretch must not look abandoned
+                try:
+                    os.utime(self.shard_filepath, None)
+                except FileNotFoundError:
+                    pass
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def list_folders(server_path, populations, already_processed = ()):
+
+    """ Returns (population, folder) pairs for all photo folders of populations, in processing order """
+
+    jobs = []
+    parent_directories = sorted([join(server_path, d) for d in os.listdir(server_path)
+                                 if isdir(join(server_path, d)) and
+                                 re.search(r"P\d?\d", d) is not None and
+                                 re.search(r"P\d?\d", d).group(0) in populations and
+                                 "Puzzle" not in d and
+                                 join(server_path, d) not in already_processed], key=str.lower)
+
+    for directory in parent_directories:
+        population = re.search(r"P\d?\d", os.path.basename(directory)).group(0)
+        child_directories = sorted([join(directory, child) for child in os.listdir(directory)
+                                    if isdir(join(directory, child)) and
+                                    join(directory, child) not in already_processed], key=str.lower)
+        jobs.extend((population, folder) for folder in child_directories)
+
+    return jobs
+
+
+def read_processed_lists(populations, processed_dir = "already_processed"):
+
+    """ Returns the set of folders recorded by the single-host launcher for populations """
+
+    already_processed = set()
+    for population in populations:
+        processed_filename = join(processed_dir, "processed_photos_{}.txt".format(population))
+        if isfile(processed_filename):
+            with open(processed_filename) as processed_file:
+                already_processed.update(line.strip() for line in processed_file)
+    return already_processed
+
+
+def staging_dir(data_dir_csv):
+    return join(data_dir_csv, ".staging")
+
+
+def remove_abandoned_shards(data_dir_csv, leases):
+
+    """ Delete shards in the staging directory not written to for longer than the lease ttl """
+
+    directory = staging_dir(data_dir_csv)
+    now = leases.now()
+    for name in os.listdir(directory):
+        shard_filepath = join(directory, name)
+        try:
+            if name.endswith(".partial") and now - os.stat(shard_filepath).st_mtime > leases.lease_ttl:
+                os.remove(shard_filepath)
+                print("removed abandoned shard {}".format(name))
+        except FileNotFoundError:
+            pass
+
+
+def data_filename(folder):
+    return "{}_pinpoint.csv".format(os.path.basename(folder))
+
+
+def shard_path(data_dir_csv, folder, worker_id):
+    return join(staging_dir(data_dir_csv), "{}.{}.partial".format(data_filename(folder), worker_id))
+
+
+def process_folder(folder, population, data_dir_csv, tags, worker_id, decode_kwargs):
+
+    """ Decodes folder into a shard owned by this worker and returns (shard, final data file) """
+
+    from barcode_tracker_photos_modified import decode
+
+    shard_filepath = shard_path(data_dir_csv, folder, worker_id)
+    with open(shard_filepath, "w") as savefile:
+        savefile.write(header)
+
+    try:
+        decode(folder, shard_filepath, tags, population, **decode_kwargs)
+    except BaseException:
+        os.remove(shard_filepath)
+        raise
+    return shard_filepath, join(data_dir_csv, data_filename(folder))
+
+
+def run_worker(server_path, data_dir_csv, lease_dir, populations, worker_id = None,
+               lease_ttl = 600, heartbeat_interval = 30, idle_exit = True, decode_kwargs = None,
+               status_dir = worker_status.status_dir):
+
+    """Claim and process folders until none are left.
+
+        Parameters
+        ----------
+        server_path : str
+            Root of the photo folders on the shared mount.
+        data_dir_csv : str
+            Directory receiving the ``<folder>_pinpoint.csv`` files.
+        lease_dir : str
+            Shared directory holding lease and done files.
+        populations : list of str
+            Populations this worker takes folders from.
+        worker_id : str, default = None
+            Unique worker name, defaults to ``<hostname>-<pid>``.
+        lease_ttl : float, default = 600
+            Seconds without heartbeat before a lease is reclaimed.
+        heartbeat_interval : float, default = 30
+            Seconds between heartbeats, must be well below lease_ttl.
+        idle_exit : bool, default = True
+            Exit when no folder could be claimed, otherwise wait for leases to expire or new folders.
+        decode_kwargs : dict, default = None
+            Extra keyword arguments passed to decode().
+        status_dir : str, default = "status"
+            Directory for the worker status file read by worker_status.py.
+
+        Returns
+        -------
+        processed : int
+            Number of folders this worker finished.
+        """
+
+    import TagList
+
+    assert heartbeat_interval < lease_ttl, "heartbeat_interval must be shorter than lease_ttl"
+
+    worker_id = worker_id or "{}-{}".format(socket.gethostname(), os.getpid())
+    decode_kwargs = dict(decode_kwargs or {})
+    if "buffers" not in decode_kwargs:
+        from barcode_tracker_photos_modified import FrameBuffers
+        decode_kwargs["buffers"] = FrameBuffers()
+    leases = LeaseDirectory(lease_dir, worker_id, lease_ttl)
+    os.makedirs(staging_dir(data_dir_csv), exist_ok = True)
+    remove_abandoned_shards(data_dir_csv, leases)
+
+    tags = TagList.TagList()
+    tags.load("master_list_outdoor.pkl")
+    already_processed = read_processed_lists(populations)
+    status = WorkerStatus(worker_id, status_dir)
+    decode_kwargs["status"] = status
+
+    processed = 0
+    while True:
+        jobs = []
+        processed_by_population = dict((population, 0) for population in populations)
+        for population, folder in list_folders(server_path, populations):
+            if (folder in already_processed or os.path.dirname(folder) in already_processed or
+                    leases.is_done(folder)):
+                processed_by_population[population] += 1
+            elif not leases.is_failed(folder):
+                jobs.append((population, folder))
+        for population in populations:
+            status.set_processed(population, processed_by_population[population])
+            status.set_pending(population, sum(1 for job in jobs if job[0] == population))
+        claimed_any = False
+
+        for population, folder in jobs:
+            if not leases.claim(folder):
+                continue
+            claimed_any = True
+            print("{} claimed {}".format(worker_id, folder))
+
+            heartbeat = Heartbeat(leases, folder, heartbeat_interval, shard_path(data_dir_csv, folder, worker_id))
+            heartbeat.start()
+            status.folder_started(folder, population)
+            t0 = time.time()
+            try:
+                shard_filepath, data_filepath = process_folder(folder, population, data_dir_csv, tags, worker_id, decode_kwargs)
+            except Exception:
+                # a folder that fails here would fail on every other worker too, so it is marked and skipped
+                heartbeat.stop()
+                message = traceback.format_exc()
+                leases.mark_failed(folder, message)
+                status.folder_failed()
+                print("{} failed on {}, skipped until {} is removed\n{}".format(worker_id, folder, leases.failed_path(folder), message))
+                continue
+            except BaseException:
+                heartbeat.stop()
+                leases.release(folder)
+                raise
+            heartbeat.stop()
+
+            if heartbeat.lost or not leases.holds(folder):
+                # another worker reclaimed the folder, its copy wins
+                os.remove(shard_filepath)
+                continue
+
+            os.replace(shard_filepath, data_filepath)
+            leases.mark_done(folder)
+            status.folder_done()
+            processed += 1
+            print("Processing took {} seconds".format(time.time() - t0))
+
+        if not claimed_any:
+            if idle_exit:
+                break
+            time.sleep(heartbeat_interval)
+
+    status.finish()
+    print("{} finished, processed {} folders".format(worker_id, processed))
+    return processed
+
+
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(description = "Process photo folders alongside other workers sharing a lease directory.")
+    parser.add_argument("populations", nargs = "+", help = "populations to take folders from, e.g. P1 P2")
+    parser.add_argument("--server-path", default = "/mnt/Videos_GRETI/field_season_fall_2020/")
+    parser.add_argument("--data-dir", default = "/home/michael/pinpoint_exp2/data/")
+    parser.add_argument("--lease-dir", required = True, help = "directory on the shared mount for lease files")
+    parser.add_argument("--worker-id", default = None)
+    parser.add_argument("--lease-ttl", type = float, default = 600)
+    parser.add_argument("--heartbeat", type = float, default = 30)
+    parser.add_argument("--pyramid-levels", type = int, default = None, help = "override the camera profiles")
+    parser.add_argument("--status-dir", default = worker_status.status_dir)
+    parser.add_argument("--wait", action = "store_true", help = "keep polling for new or expired folders instead of exiting")
+    args = parser.parse_args()
+
+    run_worker(args.server_path, args.data_dir, args.lease_dir, args.populations,
+               worker_id = args.worker_id, lease_ttl = args.lease_ttl, heartbeat_interval = args.heartbeat,
+               idle_exit = not args.wait, decode_kwargs = {"pyramid_levels": args.pyramid_levels},
+               status_dir = args.status_dir)
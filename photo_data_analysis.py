@@ -6,18 +6,17 @@ from os import rename
 import TagList
 import time
 from sys import argv
+from worker_status import WorkerStatus
+from visits import update_visits
 
 
 target_pop = argv[1]
 server_path = "/mnt/Videos_GRETI/field_season_fall_2020/"
 data_dir_csv = "/home/michael/pinpoint_exp2/data/"
+visits_dir = "/home/michael/pinpoint_exp2/visits/"
+visit_gap = 30 #seconds between detections of an ID that still count as one visit
 already_processed_filename = "already_processed/processed_photos_{}.txt".format(target_pop)
 
-with open(already_processed_filename, "a+") as processed_file:
-    processed_file.seek(0)
-    already_processed = [line.strip() for line in processed_file]
-    print("Already processed {}".format(len(already_processed)))
-
 def create_csv(data_filepath):
     with open(data_filepath, "a+") as savefile: # open data file in append mode
         # write column names to file
@@ -26,8 +25,15 @@ def create_csv(data_filepath):
 
 if __name__=="__main__":
 
+    with open(already_processed_filename, "a+") as processed_file:
+        processed_file.seek(0)
+        already_processed = [line.strip() for line in processed_file]
+        print("Already processed {}".format(len(already_processed)))
+
     tags = TagList.TagList()
     tags.load("master_list_outdoor.pkl")
+    buffers = FrameBuffers() #reused by every folder, see FrameBuffers for the memory bound
+    status = WorkerStatus(target_pop) #read by worker_status.py
 
     parent_directories = [join(server_path, d) for d in os.listdir(server_path)
                             if (isdir(join(server_path, d)) and
@@ -36,14 +42,21 @@ if __name__=="__main__":
                             join(server_path,d) not in already_processed]
     parent_directories = sorted(parent_directories, key=str.lower, reverse=False)
 
+    #these child directories are filled with photos from 5 min intervals
+    #list them all up front so the status reports the whole backlog
+    child_directories_by_parent = {}
     for directory in parent_directories:
-        #rawtime = re.search("\d\d\d\d-\d\d-\d\d_\d\d", directory).group(0)
-        population = re.search("P\d?\d", directory).group(0)
-        #these child directories are filled with photos from 5 min intervals
         child_directories = [join(server_path, directory, child) for child in os.listdir(directory)
                                 if (isdir(join(server_path, directory, child)) and
                                 join(server_path,directory,child) not in already_processed)]
-        child_directories = sorted(child_directories, key=str.lower, reverse=False)
+        child_directories_by_parent[directory] = sorted(child_directories, key=str.lower, reverse=False)
+    status.set_processed(target_pop, len(set(already_processed)))
+    status.set_pending(target_pop, sum(len(children) for children in child_directories_by_parent.values()))
+
+    for directory in parent_directories:
+        #rawtime = re.search("\d\d\d\d-\d\d-\d\d_\d\d", directory).group(0)
+        population = re.search("P\d?\d", directory).group(0)
+        child_directories = child_directories_by_parent[directory]
 
         for folder in child_directories:
             if folder not in already_processed:
@@ -53,9 +66,12 @@ if __name__=="__main__":
                     create_csv(data_filepath)
                 print(folder)
                 t0= time.time()
-                decode(folder, data_filepath, tags,population)
+                status.folder_started(folder, target_pop)
+                decode(folder, data_filepath, tags,population, buffers = buffers, status = status)
                 with open(already_processed_filename, "a+") as processed_file:
                     processed_file.write("{}\n".format(folder))
+                update_visits(data_filepath, visits_dir, visit_gap)
+                status.folder_done()
                 t1= time.time()
                 print("Processing took {} seconds".format(t1-t0))
 
@@ -63,3 +79,5 @@ if __name__=="__main__":
         print("finished processing {}".format(directory))
         #with open(already_processed_filename, "a+") as processed_file:
             #processed_file.write("{}\n".format(directory))
+
+    status.finish() #tells worker_status.py this worker ended normally
@@ -0,0 +1,8 @@
+#!/bin/sh
+# pinpoint_distributed_launcher.sh
+# joins this host to the shared backlog, run on every machine that is free overnight
+
+cd ~/pinpoint_exp2
+sleep 10
+python3 -u distributed_worker.py --lease-dir /mnt/Videos_GRETI/field_season_fall_2020_leases P1 P2 P3 P4 P5 P6 P7 P8 P9 P10 > logs/logs_worker_$(hostname) 2>&1 &
+exit 0
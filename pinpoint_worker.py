@@ -0,0 +1,219 @@
+""" Resident decoding worker fed with folder jobs over stdin or a named pipe.
+
+Starting photo_data_analysis.py once per population pays for the imports and the master list on
+every run, which dominates short reprocessing jobs. This worker loads them once and then decodes
+folders as they arrive, one job per line:
+
+    <folder>
+    <population> <folder>
+
+The population is taken from the folder path when it is not given. Empty lines and lines starting
+with # are ignored, ``quit`` stops the worker. Each finished job is answered on stdout with one
+tab-separated line ``ok <folder> <images> <seconds>`` or ``error <folder> <message>``; the progress
+output of decode() goes to stderr so stdout stays machine readable.
+
+Usage: python3 pinpoint_worker.py [--queue /tmp/pinpoint.fifo] [--data-dir DIR] [--visits-dir DIR]
+
+    ls -d /mnt/Videos_GRETI/field_season_fall_2020/*P3*/* | python3 pinpoint_worker.py
+
+Only the standard library is imported at module level; cv2, numpy and the tracker are loaded by
+DecodeWorker.load(), so ``--help`` and job parsing stay instant. See bench_startup.py for timings.
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+import traceback
+import contextlib
+from os.path import join, isfile, isdir, basename
+
+header = "population,time,id,id_prob,x,y,orientation\n"
+
+
+def parse_job(line):
+
+    """ Returns (population, folder) for a job line, or None for blank and comment lines """
+
+    line = line.strip()
+    if len(line) == 0 or line.startswith("#"):
+        return None
+    fields = line.split(None, 1)
+    if len(fields) == 2 and re.fullmatch(r"P\d?\d", fields[0]):
+        return fields[0], fields[1].strip()
+    population = re.search(r"P\d?\d", line)
+    if population is None:
+        raise ValueError("no population in job '{}'".format(line))
+    return population.group(0), line
+
+
+class DecodeWorker:
+
+    """Keeps the master list, frame buffers and processed lists in memory between folders.
+
+        Parameters
+        ----------
+        data_dir_csv : str
+            Directory receiving the ``<folder>_pinpoint.csv`` files.
+        visits_dir : str, default = None
+            Also update the visits of each finished folder, see visits.py.
+        visit_gap : float, default = 30
+            Longest gap in seconds within a visit.
+        processed_dir : str, default = "already_processed"
+            Directory of the ``processed_photos_<population>.txt`` lists shared with photo_data_analysis.py.
+        tag_filename : str, default = "master_list_outdoor.pkl"
+            TagList file.
+        status_id : str, default = None
+            Write a worker status file under this name, see worker_status.py.
+
+        """
+
+    def __init__(self, data_dir_csv, visits_dir = None, visit_gap = 30, processed_dir = "already_processed",
+                 tag_filename = "master_list_outdoor.pkl", status_id = None):
+
+        self.data_dir_csv = data_dir_csv
+        self.visits_dir = visits_dir
+        self.visit_gap = visit_gap
+        self.processed_dir = processed_dir
+        self.tag_filename = tag_filename
+        self.status_id = status_id
+        self.processed = {}
+        self.tags = None
+
+    def load(self):
+
+        """Import the decoding modules and load the master list, done once per process."""
+
+        import TagList
+        from barcode_tracker_photos_modified import FrameBuffers
+
+        os.makedirs(self.data_dir_csv, exist_ok = True)
+        os.makedirs(self.processed_dir, exist_ok = True)
+        self.tags = TagList.TagList()
+        with contextlib.redirect_stdout(sys.stderr):
+            self.tags.load(self.tag_filename)
+        self.buffers = FrameBuffers()
+        self.status = None
+        if self.status_id is not None:
+            from worker_status import WorkerStatus
+            self.status = WorkerStatus(self.status_id)
+
+    def processed_list(self, population):
+
+        """ Returns the set of folders already processed for population, read once from its list file """
+
+        if population not in self.processed:
+            processed_filename = join(self.processed_dir, "processed_photos_{}.txt".format(population))
+            folders = set()
+            if isfile(processed_filename):
+                with open(processed_filename) as processed_file:
+                    folders.update(line.strip() for line in processed_file)
+            self.processed[population] = folders
+            if self.status is not None:
+                self.status.set_processed(population, len(folders))
+        return self.processed[population]
+
+    def run_job(self, population, folder, force = False):
+
+        """Decode one folder and record it as processed.
+
+            Returns
+            -------
+            n_images : int or None
+                Number of images in the folder, None if it had been processed before.
+            """
+
+        from barcode_tracker_photos_modified import decode
+
+        if not isdir(folder):
+            raise IOError("{} is not a folder".format(folder))
+        processed = self.processed_list(population)
+        if folder in processed and not force:
+            return None
+
+        data_filepath = join(self.data_dir_csv, "{}_pinpoint.csv".format(basename(folder.rstrip("/"))))
+        if not isfile(data_filepath):
+            with open(data_filepath, "w") as savefile:
+                savefile.write(header)
+
+        if self.status is not None:
+            self.status.folder_started(folder, population)
+        with contextlib.redirect_stdout(sys.stderr):
+            decode(folder, data_filepath, self.tags, population, buffers = self.buffers, status = self.status)
+
+        with open(join(self.processed_dir, "processed_photos_{}.txt".format(population)), "a") as processed_file:
+            processed_file.write("{}\n".format(folder))
+        processed.add(folder)
+        if self.visits_dir is not None:
+            from visits import update_visits
+            update_visits(data_filepath, self.visits_dir, self.visit_gap)
+        if self.status is not None:
+            self.status.folder_done()
+            # reseed, so a forced rerun of a processed folder is not counted twice
+            self.status.set_processed(population, len(processed))
+        return sum(1 for f in os.listdir(folder) if isfile(join(folder, f)))
+
+    def serve(self, lines, force = False):
+
+        """Run the jobs read from lines until they end or a ``quit`` line arrives.
+
+            Returns
+            -------
+            stop : bool
+                True if the worker was told to quit.
+            """
+
+        for line in lines:
+            if line.strip() == "quit":
+                return True
+            try:
+                job = parse_job(line)
+                if job is None:
+                    continue
+                population, folder = job
+                t0 = time.time()
+                n_images = self.run_job(population, folder, force)
+                if n_images is None:
+                    print("skipped\t{}\talready processed".format(folder), flush = True)
+                else:
+                    print("ok\t{}\t{}\t{:.2f}".format(folder, n_images, time.time() - t0), flush = True)
+            except Exception as error:
+                traceback.print_exc(file = sys.stderr)
+                print("error\t{}\t{}".format(line.strip(), error), flush = True)
+        return False
+
+
+def read_queue(queue_path):
+
+    """ Yields job lines from a named pipe, reopening it whenever the last writer closes it """
+
+    if not os.path.exists(queue_path):
+        os.mkfifo(queue_path)
+    while True:
+        with open(queue_path) as queue:
+            for line in queue:
+                yield line
+
+
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(description = "Decode photo folders sent as lines on stdin or a named pipe.")
+    parser.add_argument("--queue", default = None, help = "named pipe to read jobs from, created if missing; default stdin")
+    parser.add_argument("--data-dir", default = "/home/michael/pinpoint_exp2/data/")
+    parser.add_argument("--visits-dir", default = None)
+    parser.add_argument("--visit-gap", type = float, default = 30)
+    parser.add_argument("--processed-dir", default = "already_processed")
+    parser.add_argument("--status-id", default = None, help = "write a status file for worker_status.py under this name")
+    parser.add_argument("--force", action = "store_true", help = "also decode folders in the processed lists")
+    args = parser.parse_args()
+
+    t0 = time.time()
+    worker = DecodeWorker(args.data_dir, args.visits_dir, args.visit_gap, args.processed_dir, status_id = args.status_id)
+    worker.load()
+    print("ready in {:.3f} s".format(time.time() - t0), file = sys.stderr, flush = True)
+
+    lines = sys.stdin if args.queue is None else read_queue(args.queue)
+    worker.serve(lines, args.force)
+    if worker.status is not None:
+        worker.status.finish()
@@ -0,0 +1,229 @@
+""" Golden-output regression and throughput check for decode().
+
+Usage: python3 regression_harness.py [--corpus regression/P1_Feeder] [--population P1] [--update]
+
+Runs decode() over a fixed local corpus of frames with master_list_outdoor.pkl and compares the
+detections with a stored golden file, matching them per frame and ID by position and checking x, y,
+orientation and id_prob against tolerances. Throughput (images/sec, best of --repeats runs) and peak
+memory of the decoding process are compared with a stored baseline. Exits with status 1 when
+detections are missing, extra or out of tolerance, or when throughput or memory regress by more than
+the allowed fractions.
+
+The corpus is any folder of frames, real or synthetic. If the default corpus does not exist it is
+generated with synthetic_frames.py, so the check runs offline with no other input. decode() runs with
+pinned parameters rather than the camera profiles found locally, so running autotune.py or
+calibrate_cameras.py does not show up as a code change. The first run, or a run with --update, writes
+the golden file and a baseline holding default_params as the pinned parameters instead of comparing;
+later runs decode with the parameters stored in the baseline. The baseline also records the host it
+was measured on; on another host the throughput check is skipped unless --strict.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import multiprocessing
+from os.path import join, isdir, isfile
+
+header = "population,time,id,id_prob,x,y,orientation\n"
+
+
+def read_rows(data_filepath):
+
+    """ Returns a dict mapping (time, id) to a list of (x, y, orientation, id_prob) from a decode() output file """
+
+    rows = {}
+    with open(data_filepath) as data_file:
+        next(data_file)
+        for line in data_file:
+            population, timeofframe, ID, id_prob, x, y, orientation = line.strip().split(",")
+            rows.setdefault((timeofframe, int(ID)), []).append((float(x), float(y), float(orientation), float(id_prob)))
+    return rows
+
+
+def angle_difference(a, b):
+    return abs((a - b + 180) % 360 - 180)
+
+
+def compare_rows(golden, rows, position_tol = 2.0, orientation_tol = 5.0, prob_tol = 0.02, match_distance = 10.0):
+
+    """Match detections against the golden detections of the same frame and ID.
+
+        Parameters
+        ----------
+        golden, rows : dict
+            (time, id) -> list of (x, y, orientation, id_prob), see read_rows().
+        position_tol : float, default = 2.0
+            Largest allowed change of x or y in pixels.
+        orientation_tol : float, default = 5.0
+            Largest allowed change of orientation in degrees.
+        prob_tol : float, default = 0.02
+            Largest allowed change of id_prob.
+        match_distance : float, default = 10.0
+            Detections further apart than this many pixels are not paired at all.
+
+        Returns
+        -------
+        report : dict
+            'missing' and 'extra' list (time, id, detection) found only in golden or only in rows,
+            'changed' lists (time, id, golden detection, detection) of pairs outside a tolerance,
+            'matched' counts the pairs within tolerance.
+        """
+
+    report = {"missing" : [], "extra" : [], "changed" : [], "matched" : 0}
+    for key in sorted(set(golden) | set(rows)):
+        remaining = list(rows.get(key, []))
+        for expected in golden.get(key, []):
+            distances = [((expected[0] - found[0])**2 + (expected[1] - found[1])**2)**0.5 for found in remaining]
+            if len(distances) == 0 or min(distances) > match_distance:
+                report["missing"].append(key + (expected,))
+                continue
+            found = remaining.pop(distances.index(min(distances)))
+            if (abs(expected[0] - found[0]) > position_tol or abs(expected[1] - found[1]) > position_tol or
+                    angle_difference(expected[2], found[2]) > orientation_tol or abs(expected[3] - found[3]) > prob_tol):
+                report["changed"].append(key + (expected, found))
+            else:
+                report["matched"] += 1
+        report["extra"].extend(key + (found,) for found in remaining)
+    return report
+
+
+def run_corpus(frames_dir, population, data_filepath, tag_filename, params):
+
+    """ Decodes frames_dir with params into data_filepath and returns (seconds, number of images, peak RSS in MB) of this process """
+
+    import resource
+    import contextlib
+    import TagList
+    from barcode_tracker_photos_modified import decode
+
+    with open(data_filepath, "w") as savefile:
+        savefile.write(header)
+    tags = TagList.TagList()
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        tags.load(tag_filename)
+        t0 = time.perf_counter()
+        decode(frames_dir, data_filepath, tags, population, params = params)
+        elapsed = time.perf_counter() - t0
+    n_images = len([f for f in os.listdir(frames_dir) if isfile(join(frames_dir, f))])
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak/2.0**20 if sys.platform == "darwin" else peak/2.0**10
+    return elapsed, n_images, peak_mb
+
+
+def measure(frames_dir, population, data_filepath, tag_filename, repeats, params):
+
+    """ Runs run_corpus() in fresh processes and returns (best images/sec, largest peak RSS in MB) """
+
+    # spawned processes start clean, so the peak memory is that of decoding alone
+    context = multiprocessing.get_context("spawn")
+    rates, peaks = [], []
+    for i in range(repeats):
+        with context.Pool(1) as pool:
+            elapsed, n_images, peak_mb = pool.apply(run_corpus, (frames_dir, population, data_filepath, tag_filename, params))
+        rates.append(n_images/max(elapsed, 1e-9))
+        peaks.append(peak_mb)
+    return max(rates), max(peaks)
+
+
+def make_corpus(corpus_dir, population, n_images, tag_filename):
+
+    """ Writes a synthetic corpus with frames/ and labels.csv to corpus_dir """
+
+    import contextlib
+    import TagList
+    from synthetic_frames import make_frames
+    from barcode_tracker_photos_modified import approved_ids
+
+    tags = TagList.TagList()
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        tags.load(tag_filename)
+    camera = os.path.basename(corpus_dir.rstrip("/"))
+    make_frames(corpus_dir, tags, approved_ids(population), n_images = n_images, camera = camera)
+
+
+def print_report(report, limit = 10):
+    print("golden comparison: {} matched, {} missing, {} extra, {} changed".format(
+        report["matched"], len(report["missing"]), len(report["extra"]), len(report["changed"])))
+    for kind in ["missing", "extra", "changed"]:
+        for entry in report[kind][:limit]:
+            print("  {:<8} {} id {}: {}".format(kind, entry[0], entry[1], " -> ".join(str(detection) for detection in entry[2:])))
+        if len(report[kind]) > limit:
+            print("  ... {} more {}".format(len(report[kind]) - limit, kind))
+
+
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(description = "Check decode() against golden detections and a throughput baseline.")
+    parser.add_argument("--corpus", default = "regression/P1_Feeder", help = "folder with a frames/ subfolder, generated if it is the default and missing")
+    parser.add_argument("--population", default = "P1")
+    parser.add_argument("--golden", default = None, help = "golden detections, default <corpus>/golden.csv")
+    parser.add_argument("--baseline", default = None, help = "throughput baseline, default <corpus>/baseline.json")
+    parser.add_argument("--tags", default = "master_list_outdoor.pkl")
+    parser.add_argument("--images", type = int, default = 40, help = "frames in a generated corpus")
+    parser.add_argument("--repeats", type = int, default = 3, help = "timed runs, the fastest counts")
+    parser.add_argument("--position-tol", type = float, default = 2.0)
+    parser.add_argument("--orientation-tol", type = float, default = 5.0)
+    parser.add_argument("--prob-tol", type = float, default = 0.02)
+    parser.add_argument("--max-mismatches", type = int, default = 0, help = "missing, extra and changed detections tolerated")
+    parser.add_argument("--max-slowdown", type = float, default = 0.15, help = "allowed drop of images/sec as a fraction of the baseline")
+    parser.add_argument("--max-memory-growth", type = float, default = 0.15, help = "allowed growth of peak memory as a fraction of the baseline")
+    parser.add_argument("--strict", action = "store_true", help = "check throughput even if the baseline was measured on another host")
+    parser.add_argument("--update", action = "store_true", help = "overwrite the golden file and baseline with this run")
+    args = parser.parse_args()
+
+    frames_dir = join(args.corpus, "frames")
+    golden_filepath = args.golden or join(args.corpus, "golden.csv")
+    baseline_filepath = args.baseline or join(args.corpus, "baseline.json")
+    if not isdir(frames_dir):
+        if args.corpus != parser.get_default("corpus"):
+            sys.exit("no frames/ folder in {}".format(args.corpus))
+        print("generating synthetic corpus in {}".format(args.corpus))
+        make_corpus(args.corpus, args.population, args.images, args.tags)
+
+    import camera_profiles
+    update = args.update or not isfile(golden_filepath) or not isfile(baseline_filepath)
+    if update:
+        params = dict(camera_profiles.default_params)
+    else:
+        with open(baseline_filepath) as baseline_file:
+            baseline = json.load(baseline_file)
+        # keys added to default_params since the baseline keep their defaults
+        params = dict(camera_profiles.default_params, **baseline["params"])
+
+    output_filepath = join(args.corpus, "output.csv")
+    images_per_sec, peak_mb = measure(frames_dir, args.population, output_filepath, args.tags, args.repeats, params)
+    print("{:.2f} images/sec, peak memory {:.0f} MB".format(images_per_sec, peak_mb))
+
+    if update:
+        os.replace(output_filepath, golden_filepath)
+        baseline = {"images_per_sec" : images_per_sec, "peak_mb" : peak_mb, "host" : socket.gethostname(),
+                    "updated" : time.strftime("%Y-%m-%d %H:%M:%S"), "params" : params}
+        with open(baseline_filepath, "w") as baseline_file:
+            json.dump(baseline, baseline_file, indent = 4)
+        print("wrote {} and {}".format(golden_filepath, baseline_filepath))
+        sys.exit(0)
+
+    failures = []
+    report = compare_rows(read_rows(golden_filepath), read_rows(output_filepath),
+                          args.position_tol, args.orientation_tol, args.prob_tol)
+    print_report(report)
+    mismatches = len(report["missing"]) + len(report["extra"]) + len(report["changed"])
+    if mismatches > args.max_mismatches:
+        failures.append("{} detections differ from the golden file".format(mismatches))
+
+    print("baseline {:.2f} images/sec, peak memory {:.0f} MB (host {})".format(baseline["images_per_sec"], baseline["peak_mb"], baseline["host"]))
+    if baseline["host"] != socket.gethostname() and not args.strict:
+        print("baseline from another host, throughput and memory not checked")
+    else:
+        if images_per_sec < baseline["images_per_sec"]*(1 - args.max_slowdown):
+            failures.append("throughput dropped to {:.2f} from {:.2f} images/sec".format(images_per_sec, baseline["images_per_sec"]))
+        if peak_mb > baseline["peak_mb"]*(1 + args.max_memory_growth):
+            failures.append("peak memory grew to {:.0f} from {:.0f} MB".format(peak_mb, baseline["peak_mb"]))
+
+    for failure in failures:
+        print("REGRESSION: {}".format(failure))
+    sys.exit(1 if len(failures) > 0 else 0)
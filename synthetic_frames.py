@@ -0,0 +1,149 @@
+""" Synthetic photo folders with known tags, for tuning and regression-testing decode() offline.
+
+Usage: python3 synthetic_frames.py <output_dir> <population> [n_images]
+
+Writes n_images frames named like the camera photos (``<camera>_YYYY-mm-dd-HH-MM-SS-ffffff.jpg``)
+to ``<output_dir>/frames`` and a ``<output_dir>/labels.csv`` with one ``time,id,x,y`` row per tag placed
+in a frame. The labels sit outside the frames folder because decode() reads every file in its folder.
+"""
+
+import os
+import datetime as dt
+from os.path import join
+from sys import argv
+
+import numpy as np
+import cv2
+import utils
+
+labels_header = "time,id,x,y\n"
+
+
+def render_tag(tags, ID, module_px, background = 200):
+
+    """Returns the bordered tag ID as a uint8 image with module_px pixels per bit.
+
+        Parameters
+        ----------
+        tags : TagList
+            Loaded TagList, the first of the four rotations of ID is rendered.
+        ID : int
+            Tag ID.
+        module_px : int
+            Side length of one bit in pixels.
+        background : int, default = 200
+            Gray level of the padding around the tag.
+        """
+
+    index = list(tags.id_list).index(ID)
+    border_shape, tag = utils.add_border(tags.master_list[index], tags.tag_shape, tags.white_width, tags.black_width)
+    tag = (tag.reshape(border_shape)*255).astype(np.uint8)
+    tag = cv2.resize(tag, (border_shape[1]*module_px, border_shape[0]*module_px), interpolation = cv2.INTER_NEAREST)
+    pad = tag.shape[0] // 2
+    return cv2.copyMakeBorder(tag, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value = background)
+
+
+def make_frames(output_dir, tags, IDs, n_images = 20, frame_shape = (1200, 1600), tags_per_frame = 3,
+                module_px = (2, 3), empty_fraction = 0.5, camera = "P1_Feeder", seed = 0):
+
+    """Write synthetic frames with tags from IDs pasted on a textured background.
+
+        Parameters
+        ----------
+        output_dir : str
+            Folder receiving frames/ and labels.csv, created if needed.
+        tags : TagList
+            Loaded TagList.
+        IDs : list of int
+            IDs to draw tags from, e.g. the approved list of a population.
+        n_images : int, default = 20
+            Number of frames.
+        frame_shape : tuple of int, default = (1200, 1600)
+            Frame height and width in pixels.
+        tags_per_frame : int, default = 3
+            Number of tags in frames that contain tags.
+        module_px : tuple of int, default = (2, 3)
+            Range of pixels per bit, sets the tag size.
+        empty_fraction : float, default = 0.5
+            Fraction of frames without any tag.
+        camera : str, default = "P1_Feeder"
+            Prefix of the file names.
+        seed : int, default = 0
+            Random seed, the same seed gives the same folder.
+
+        Returns
+        -------
+        labels : list of tuple
+            (time, id, x, y) of every placed tag, as written to labels.csv.
+        """
+
+    rng = np.random.RandomState(seed)
+    frames_dir = join(output_dir, "frames")
+    os.makedirs(frames_dir, exist_ok = True)
+    height, width = frame_shape
+    start = dt.datetime(2020, 10, 1, 8, 0, 0)
+    labels = []
+
+    for i in range(n_images):
+        # smooth noise looks more like foliage and plumage than flat gray
+        frame = rng.normal(120, 25, (height, width)).astype(np.float32)
+        frame = np.clip(cv2.GaussianBlur(frame, (0, 0), 6), 0, 255).astype(np.uint8)
+
+        timeofframe = start + dt.timedelta(seconds = 5*i)
+        n_tags = 0 if rng.uniform() < empty_fraction else tags_per_frame
+        occupied = []
+        for j in range(n_tags):
+            ID = int(rng.choice(IDs))
+            tag = render_tag(tags, ID, int(rng.randint(module_px[0], module_px[1] + 1)))
+            M = cv2.getRotationMatrix2D((tag.shape[1]/2.0, tag.shape[0]/2.0), rng.uniform(0, 360), 1)
+            tag = cv2.warpAffine(tag, M, (tag.shape[1], tag.shape[0]), borderValue = 200)
+
+            # keep tags apart from each other and from the frame edge
+            for attempt in range(50):
+                y = int(rng.randint(20, height - tag.shape[0] - 20))
+                x = int(rng.randint(20, width - tag.shape[1] - 20))
+                if all(abs(x - ox) > tag.shape[1] + 20 or abs(y - oy) > tag.shape[0] + 20 for ox, oy in occupied):
+                    break
+            occupied.append((x, y))
+            frame[y:y + tag.shape[0], x:x + tag.shape[1]] = tag
+            labels.append((timeofframe, ID, x + tag.shape[1]/2.0, y + tag.shape[0]/2.0))
+
+        image_name = "{}_{}.jpg".format(camera, timeofframe.strftime("%Y-%m-%d-%H-%M-%S-%f"))
+        cv2.imwrite(join(frames_dir, image_name), cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR), [cv2.IMWRITE_JPEG_QUALITY, 95])
+
+    with open(join(output_dir, "labels.csv"), "w") as labels_file:
+        labels_file.write(labels_header)
+        for timeofframe, ID, x, y in labels:
+            labels_file.write("{},{},{},{}\n".format(timeofframe, ID, x, y))
+
+    return labels
+
+
+def read_labels(labels_filepath):
+
+    """ Returns a dict mapping (time, id) to the number of tags labelled in that frame """
+
+    counts = {}
+    with open(labels_filepath) as labels_file:
+        next(labels_file)
+        for line in labels_file:
+            timeofframe, ID = line.strip().split(",")[:2]
+            key = (timeofframe, int(ID))
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+if __name__=="__main__":
+
+    import TagList
+    from barcode_tracker_photos_modified import approved_ids
+
+    output_dir = argv[1]
+    population = argv[2]
+    n_images = int(argv[3]) if len(argv) > 3 else 20
+
+    tags = TagList.TagList()
+    tags.load("master_list_outdoor.pkl")
+    labels = make_frames(output_dir, tags, approved_ids(population), n_images = n_images,
+                         camera = "{}_Feeder".format(population))
+    print("wrote {} frames with {} tags to {}".format(n_images, len(labels), output_dir))
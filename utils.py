@@ -3,7 +3,6 @@
 import numpy as np
 import cv2
 
-from scipy.spatial import distance as dist
 
 def rotate_tag90(tag, tag_shape, n=1):
     
@@ -159,7 +158,7 @@ def order_points(pts):
     # top-left and right-most points; by the Pythagorean
     # theorem, the point with the largest distance will be
     # our bottom-right point
-    D = dist.cdist(tl[np.newaxis], right, "euclidean")[0]
+    D = np.sqrt(np.sum(np.square(right - tl), axis = 1))
     (br, tr) = right[np.argsort(D)[::-1], :]
     
     # return the coordinates in clockwise order 
@@ -236,3 +235,46 @@ def angle(v1, v2, degrees = True):
     if degrees == True:
         angle = np.degrees(angle)
     return angle
+
+def write_pdf(pages, page_size, filename):
+
+    """Write a multi-page PDF from raw page content streams.
+
+        Parameters
+        ----------
+        pages : list of str
+            PDF content stream of each page, in points from the bottom-left corner.
+            Font /F1 is Helvetica.
+        page_size : tuple of float
+            Page width and height in points (1/72 inch).
+        filename : str
+            Path of the PDF file.
+
+        """
+
+    import zlib
+
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for content in pages:
+        stream = zlib.compress(content.encode("latin-1"))
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] /Contents %d 0 R "
+                        "/Resources << /Font << /F1 3 0 R >> >> >>" % (page_size[0], page_size[1], len(objects))).encode("latin-1"))
+        kids.append("%d 0 R" % len(objects))
+    objects[1] = ("<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(kids), len(kids))).encode("latin-1")
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + obj + b"\nendobj\n"
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+
+    with open(filename, "wb") as pdf_file:
+        pdf_file.write(output)
@@ -0,0 +1,288 @@
+""" Compress per-frame detections into visits.
+
+Consecutive detections of the same ID by the same camera that are at most max_gap seconds apart are
+linked into one visit, summarised by start, end, frame count, mean and max id_prob, and position and
+orientation summaries. Visits are built incrementally: each folder's CSV is fed in time order, visits
+that can no longer be extended are written out, and the open ones are carried over to the next folder
+through a small per-camera state file. The state also keeps the time of the latest detection fed, and a
+file with detections before it is refused with a ValueError rather than merged into visits that already
+moved past it, so folders must reach a camera's visits in chronological order. Where folders finish out
+of order, as with distributed_worker.py, run this only once all earlier folders of a camera are finished.
+
+Usage: python3 visits.py <data_dir> <visits_dir> [--gap 30]
+
+processes every ``*_pinpoint.csv`` in data_dir that has not been processed before, per camera in
+chronological order, and appends to ``<visits_dir>/<camera>_visits.csv``.
+"""
+
+import os
+import csv
+import json
+import math
+import argparse
+import datetime as dt
+from os.path import join, isfile, basename
+
+import camera_profiles
+
+visit_columns = ["population", "id", "start", "end", "n_frames", "n_detections", "mean_id_prob", "max_id_prob",
+                 "mean_x", "mean_y", "min_x", "max_x", "min_y", "max_y", "mean_orientation", "orientation_spread"]
+
+
+class Visit:
+
+    """Running summary of the detections of one ID in one visit."""
+
+    def __init__(self, population, ID, timeofframe):
+
+        self.population = population
+        self.ID = ID
+        self.start = timeofframe
+        self.end = timeofframe
+        self.n_frames = 0
+        self.n_detections = 0
+        self.sum_prob = 0.0
+        self.max_prob = -1.0
+        self.sum_x = 0.0
+        self.sum_y = 0.0
+        self.min_x = self.min_y = float("inf")
+        self.max_x = self.max_y = -float("inf")
+        self.sum_sin = 0.0
+        self.sum_cos = 0.0
+
+    def add(self, timeofframe, id_prob, x, y, orientation):
+        if self.n_detections == 0 or timeofframe != self.end:
+            self.n_frames += 1
+        self.end = timeofframe
+        self.n_detections += 1
+        self.sum_prob += id_prob
+        self.max_prob = max(self.max_prob, id_prob)
+        self.sum_x += x
+        self.sum_y += y
+        self.min_x, self.max_x = min(self.min_x, x), max(self.max_x, x)
+        self.min_y, self.max_y = min(self.min_y, y), max(self.max_y, y)
+        self.sum_sin += math.sin(math.radians(orientation))
+        self.sum_cos += math.cos(math.radians(orientation))
+
+    def row(self):
+
+        """ Returns the visit as a list of values in visit_columns order """
+
+        n = float(self.n_detections)
+        mean_orientation = math.degrees(math.atan2(self.sum_sin, self.sum_cos)) % 360
+        # 1 - mean resultant length: 0 when all orientations agree, 1 when they are spread evenly
+        spread = 1 - math.hypot(self.sum_sin, self.sum_cos)/n
+        return [self.population, self.ID, self.start, self.end, self.n_frames, self.n_detections,
+                round(self.sum_prob/n, 4), round(self.max_prob, 4), round(self.sum_x/n, 2), round(self.sum_y/n, 2),
+                self.min_x, self.max_x, self.min_y, self.max_y, round(mean_orientation, 1) % 360, round(spread, 3)]
+
+    def to_state(self):
+        state = dict(self.__dict__)
+        state["start"] = self.start.isoformat()
+        state["end"] = self.end.isoformat()
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        visit = cls(state["population"], state["ID"], None)
+        visit.__dict__.update(state)
+        visit.start = dt.datetime.fromisoformat(state["start"])
+        visit.end = dt.datetime.fromisoformat(state["end"])
+        return visit
+
+
+class VisitBuilder:
+
+    """Links detections of one camera into visits.
+
+        Parameters
+        ----------
+        max_gap : float, default = 30
+            Longest time in seconds between two detections of an ID that still belong to one visit.
+
+        """
+
+    def __init__(self, max_gap = 30):
+
+        self.max_gap = dt.timedelta(seconds = max_gap)
+        self.open_visits = {}
+        self.processed_files = []
+        self.latest = None # time of the latest detection fed, earlier ones would corrupt the visits
+
+    def add(self, population, timeofframe, ID, id_prob, x, y, orientation):
+
+        """Add one detection, detections must arrive in time order. Returns the visit it closed, if any."""
+
+        if self.latest is not None and timeofframe < self.latest:
+            raise ValueError("detection at {} is earlier than the latest one fed at {}".format(timeofframe, self.latest))
+        self.latest = timeofframe
+        key = (population, ID)
+        closed = None
+        visit = self.open_visits.get(key)
+        if visit is not None and timeofframe - visit.end > self.max_gap:
+            closed = self.open_visits.pop(key)
+            visit = None
+        if visit is None:
+            visit = self.open_visits[key] = Visit(population, ID, timeofframe)
+        visit.add(timeofframe, id_prob, x, y, orientation)
+        return closed
+
+    def close_before(self, timeofframe):
+
+        """Close and return the visits that a detection at timeofframe or later can no longer extend."""
+
+        closed = [key for key, visit in self.open_visits.items() if timeofframe - visit.end > self.max_gap]
+        return [self.open_visits.pop(key) for key in closed]
+
+    def close_all(self):
+        closed = list(self.open_visits.values())
+        self.open_visits = {}
+        return closed
+
+    def add_file(self, data_filepath):
+
+        """Feed all detections of a decode() output file and return the visits that were closed.
+
+        Visits still open at the end of the file stay open so that the next folder can extend them.
+        Raises ValueError, before adding anything, if the file has detections earlier than ones already fed.
+        """
+
+        with open(data_filepath) as data_file:
+            rows = [(dt.datetime.fromisoformat(row["time"]), row) for row in csv.DictReader(data_file)]
+        rows.sort(key = lambda item: item[0])
+        if len(rows) > 0 and self.latest is not None and rows[0][0] < self.latest:
+            raise ValueError("{} starts at {}, before detections already in the visits (up to {}); "
+                             "files must be added in chronological order".format(basename(data_filepath), rows[0][0], self.latest))
+
+        closed = []
+        for timeofframe, row in rows:
+            visit = self.add(row["population"], timeofframe, int(row["id"]), float(row["id_prob"]),
+                             float(row["x"]), float(row["y"]), float(row["orientation"]))
+            if visit is not None:
+                closed.append(visit)
+        if len(rows) > 0:
+            closed.extend(self.close_before(rows[-1][0]))
+        self.processed_files.append(basename(data_filepath))
+        return sorted(closed, key = lambda visit: visit.start)
+
+    def save(self, state_filepath):
+        state = {"max_gap" : self.max_gap.total_seconds(),
+                 "processed_files" : self.processed_files,
+                 "latest" : None if self.latest is None else self.latest.isoformat(),
+                 "open_visits" : [visit.to_state() for visit in self.open_visits.values()]}
+        with open(state_filepath + ".tmp", "w") as state_file:
+            json.dump(state, state_file)
+        os.replace(state_filepath + ".tmp", state_filepath)
+
+    @classmethod
+    def load(cls, state_filepath, max_gap = 30):
+
+        """Returns the builder saved at state_filepath, or a new one if there is no state yet."""
+
+        if not isfile(state_filepath):
+            return cls(max_gap)
+        with open(state_filepath) as state_file:
+            state = json.load(state_file)
+        builder = cls(state["max_gap"])
+        builder.processed_files = state["processed_files"]
+        for visit_state in state["open_visits"]:
+            visit = Visit.from_state(visit_state)
+            builder.open_visits[(visit.population, visit.ID)] = visit
+        if state.get("latest") is not None:
+            builder.latest = dt.datetime.fromisoformat(state["latest"])
+        elif len(builder.open_visits) > 0:
+            # state written before the high-water mark was kept
+            builder.latest = max(visit.end for visit in builder.open_visits.values())
+        return builder
+
+
+def write_visits(visits, visits_filepath):
+
+    """ Append visits to visits_filepath, writing the header if the file is new """
+
+    new_file = not isfile(visits_filepath)
+    with open(visits_filepath, "a", newline = "") as visits_file:
+        writer = csv.writer(visits_file)
+        if new_file:
+            writer.writerow(visit_columns)
+        for visit in visits:
+            writer.writerow(visit.row())
+
+
+def camera_name(data_filepath):
+
+    """ Returns the camera a decode() output file belongs to, from its folder name """
+
+    return camera_profiles.camera_key(basename(data_filepath)) or "unknown"
+
+
+def update_visits(data_filepath, visits_dir, max_gap = 30):
+
+    """Add one finished folder's detections to the visits of its camera.
+
+        Parameters
+        ----------
+        data_filepath : str
+            decode() output file of the folder.
+        visits_dir : str
+            Directory holding ``<camera>_visits.csv`` and the ``<camera>_visits_state.json`` carried between folders.
+        max_gap : float, default = 30
+            Longest gap in seconds within a visit, only used when the camera has no state yet.
+
+        Returns
+        -------
+        n_visits : int
+            Number of visits closed and written.
+
+        Raises ValueError if the folder is earlier than detections already in the camera's visits, see
+        VisitBuilder.add_file(). A file is only added once, by name, so a folder re-decoded after a crash,
+        whose rows were appended a second time to the same CSV, has those detections counted twice in its
+        visits.
+        """
+
+    os.makedirs(visits_dir, exist_ok = True)
+    camera = camera_name(data_filepath)
+    state_filepath = join(visits_dir, "{}_visits_state.json".format(camera))
+    builder = VisitBuilder.load(state_filepath, max_gap)
+    if basename(data_filepath) in builder.processed_files:
+        return 0
+
+    closed = builder.add_file(data_filepath)
+    write_visits(closed, join(visits_dir, "{}_visits.csv".format(camera)))
+    builder.save(state_filepath)
+    return len(closed)
+
+
+def close_open_visits(visits_dir):
+
+    """ Write out every visit still open in visits_dir, e.g. at the end of the season """
+
+    for name in sorted(os.listdir(visits_dir)):
+        if name.endswith("_visits_state.json"):
+            camera = name[:-len("_visits_state.json")]
+            state_filepath = join(visits_dir, name)
+            builder = VisitBuilder.load(state_filepath)
+            write_visits(sorted(builder.close_all(), key = lambda visit: visit.start), join(visits_dir, "{}_visits.csv".format(camera)))
+            builder.save(state_filepath)
+
+
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(description = "Compress per-frame detections into visits.")
+    parser.add_argument("data_dir")
+    parser.add_argument("visits_dir")
+    parser.add_argument("--gap", type = float, default = 30, help = "longest gap in seconds within a visit")
+    parser.add_argument("--close", action = "store_true", help = "also close the visits still open at the end")
+    args = parser.parse_args()
+
+    # file names start with the folder name, which sorts chronologically within a camera
+    data_files = sorted([f for f in os.listdir(args.data_dir) if f.endswith("_pinpoint.csv")], key = str.lower)
+    n_visits = 0
+    for data_file in data_files:
+        try:
+            n_visits += update_visits(join(args.data_dir, data_file), args.visits_dir, args.gap)
+        except ValueError as error:
+            print("skipped: {}".format(error))
+    if args.close:
+        close_open_visits(args.visits_dir)
+    print("{} files, {} visits closed".format(len(data_files), n_visits))
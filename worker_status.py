@@ -0,0 +1,353 @@
+""" Backlog and throughput status of the photo processing workers.
+
+Every worker keeps a WorkerStatus and rewrites ``<status_dir>/<worker_id>.json`` every few seconds with
+its counters: folders and images done in this run, folders processed over the season and folders still
+pending per population, recent images/sec and a heartbeat timestamp. Nothing is rescanned on the NAS;
+pending and processed folders come from the folder lists and processed records the workers read anyway.
+A worker that exits normally writes a final ``finished`` state and is not reported as stalled.
+
+Run this module to combine all worker files into a per-population and overall summary:
+
+    python3 worker_status.py [status_dir] [--json status.json] [--prom status.prom] [--watch 60]
+"""
+
+import os
+import json
+import time
+import socket
+import argparse
+from collections import deque
+from os.path import join
+
+status_dir = "status"
+rate_windows = [60, 300, 900] # seconds over which images/sec is reported
+
+
+class WorkerStatus:
+
+    """Counters of one worker, periodically written to a JSON file.
+
+        Parameters
+        ----------
+        worker_id : str
+            Unique worker name, used as the file name.
+        status_dir : str, default = "status"
+            Directory shared by all workers of a host (or all hosts).
+        interval : float, default = 10
+            Minimum seconds between two writes of the status file.
+
+        """
+
+    def __init__(self, worker_id, status_dir = status_dir, interval = 10):
+
+        self.worker_id = worker_id
+        self.status_dir = status_dir
+        self.interval = interval
+        self.status_path = join(status_dir, "{}.json".format(worker_id))
+        os.makedirs(status_dir, exist_ok = True)
+
+        self.started = time.time()
+        self.last_write = 0
+        self.current_folder = None
+        self.current_population = None
+        self.finished = False
+        self.populations = {}
+        self.images_done = 0
+        self.history = deque() # (time, images_done) samples for the rate windows
+
+    def population(self, population):
+        if population not in self.populations:
+            self.populations[population] = {"folders_done" : 0, "images_done" : 0, "folders_pending" : 0,
+                                            "folders_processed" : None, "done_at_seed" : 0, "history" : deque()}
+        return self.populations[population]
+
+    def set_pending(self, population, folders_pending):
+
+        """Record how many folders of population are still waiting to be processed."""
+
+        self.population(population)["folders_pending"] = folders_pending
+        self.write()
+
+    def set_processed(self, population, folders_processed):
+
+        """Record how many folders of population the processed records list as done, from any run or worker.
+
+        Folders this worker finishes afterwards are added on top until the next call.
+        """
+
+        counters = self.population(population)
+        counters["folders_processed"] = folders_processed
+        counters["done_at_seed"] = counters["folders_done"]
+        self.write()
+
+    def folder_started(self, folder, population):
+        self.current_folder = folder
+        self.current_population = population
+        self.population(population)
+        self.write()
+
+    def image_done(self, n = 1):
+        self.images_done += n
+        if self.current_population is not None:
+            self.populations[self.current_population]["images_done"] += n
+        if time.time() - self.last_write >= self.interval:
+            self.write()
+
+    def folder_done(self):
+        counters = self.population(self.current_population)
+        counters["folders_done"] += 1
+        counters["folders_pending"] = max(0, counters["folders_pending"] - 1)
+        self.current_folder = None
+        self.write()
+
+    def folder_failed(self):
+        counters = self.population(self.current_population)
+        counters["folders_pending"] = max(0, counters["folders_pending"] - 1)
+        self.current_folder = None
+        self.write()
+
+    def finish(self):
+
+        """Write the final state of a worker that is exiting normally."""
+
+        self.finished = True
+        self.current_folder = None
+        self.write()
+
+    def write(self):
+
+        """Rewrite the status file atomically."""
+
+        now = time.time()
+        self.last_write = now
+        sample_history(self.history, now, self.images_done)
+        populations = {}
+        for population, counters in self.populations.items():
+            sample_history(counters["history"], now, counters["images_done"])
+            folders_processed = counters["folders_processed"]
+            if folders_processed is not None:
+                folders_processed += counters["folders_done"] - counters["done_at_seed"]
+            populations[population] = {"folders_done" : counters["folders_done"],
+                                       "folders_processed" : folders_processed,
+                                       "images_done" : counters["images_done"],
+                                       "folders_pending" : counters["folders_pending"],
+                                       "images_per_sec" : window_rates(counters["history"], now)}
+
+        status = {"worker_id" : self.worker_id,
+                  "host" : socket.gethostname(),
+                  "pid" : os.getpid(),
+                  "started" : self.started,
+                  "updated" : now,
+                  "finished" : self.finished,
+                  "current_folder" : self.current_folder,
+                  "images_done" : self.images_done,
+                  "images_per_sec" : window_rates(self.history, now),
+                  "populations" : populations}
+
+        tmp_path = self.status_path + ".tmp"
+        with open(tmp_path, "w") as status_file:
+            json.dump(status, status_file)
+        os.replace(tmp_path, self.status_path)
+
+
+def sample_history(history, now, images_done):
+
+    """ Append a (now, images_done) sample and drop samples older than the longest rate window """
+
+    history.append((now, images_done))
+    while len(history) > 1 and now - history[1][0] >= max(rate_windows):
+        history.popleft()
+
+
+def window_rates(history, now):
+
+    """ Returns {window: images/sec} over each of rate_windows from the history samples """
+
+    rates = {}
+    latest_time, latest_done = history[-1]
+    for window in rate_windows:
+        oldest = [sample for sample in history if now - sample[0] <= window]
+        first_time, first_done = oldest[0] if len(oldest) > 0 else history[-1]
+        elapsed = latest_time - first_time
+        rates[str(window)] = (latest_done - first_done)/elapsed if elapsed > 0 else 0.0
+    return rates
+
+
+def read_statuses(status_dir = status_dir):
+
+    """ Returns the status dicts of all workers that wrote to status_dir """
+
+    statuses = []
+    for name in sorted(os.listdir(status_dir)):
+        if name.endswith(".json"):
+            try:
+                with open(join(status_dir, name)) as status_file:
+                    statuses.append(json.load(status_file))
+            except ValueError:
+                pass # being rewritten
+    return statuses
+
+
+def summarize(statuses, stale_after = 300, now = None):
+
+    """Combine worker statuses into per-population and overall backlog figures.
+
+        Parameters
+        ----------
+        statuses : list of dict
+            Worker status dicts, see read_statuses().
+        stale_after : float, default = 300
+            Seconds without an update after which a worker is reported as stalled.
+        now : float, default = None
+            Current time, defaults to time.time().
+
+        Returns
+        -------
+        summary : dict
+            'populations' and 'overall' figures and a 'workers' list with heartbeat age and stall flag.
+            Workers that wrote a finished state are never stalled. Pending and processed (season total)
+            folders of a population come from its most recently updated worker that reported them, done
+            counters of the current runs and rates are summed over running workers. Pending images are estimated from the images per folder
+            seen so far, and the ETA from the 5-minute rate.
+        """
+
+    now = time.time() if now is None else now
+    eta_window = "300"
+    populations = {}
+    workers = []
+
+    for status in statuses:
+        age = now - status["updated"]
+        finished = status.get("finished", False)
+        alive = age <= stale_after and not finished
+        workers.append({"worker_id" : status["worker_id"], "host" : status["host"], "pid" : status["pid"],
+                        "heartbeat_age" : age, "stalled" : age > stale_after and not finished, "finished" : finished,
+                        "current_folder" : status["current_folder"], "images_done" : status["images_done"],
+                        "images_per_sec" : status["images_per_sec"][eta_window] if alive else 0.0})
+
+        for population, counters in status["populations"].items():
+            summary = populations.setdefault(population, {"folders_done" : 0, "images_done" : 0, "folders_pending" : 0,
+                                                          "folders_processed" : None,
+                                                          "images_per_sec" : dict((str(w), 0.0) for w in rate_windows),
+                                                          "workers" : 0, "updated" : 0, "processed_updated" : 0})
+            summary["folders_done"] += counters["folders_done"]
+            summary["images_done"] += counters["images_done"]
+            if status["updated"] > summary["updated"]:
+                summary["updated"] = status["updated"]
+                summary["folders_pending"] = counters["folders_pending"]
+            if counters.get("folders_processed") is not None and status["updated"] > summary["processed_updated"]:
+                summary["processed_updated"] = status["updated"]
+                summary["folders_processed"] = counters["folders_processed"]
+            if alive:
+                summary["workers"] += 1
+                for window, rate in counters["images_per_sec"].items():
+                    summary["images_per_sec"][window] += rate
+
+    overall = {"folders_done" : 0, "images_done" : 0, "folders_pending" : 0, "images_pending" : 0, "folders_processed" : 0,
+               "images_per_sec" : dict((str(w), 0.0) for w in rate_windows)}
+    for population, summary in populations.items():
+        del summary["updated"]
+        del summary["processed_updated"]
+        if summary["folders_processed"] is None:
+            # no processed records reported, fall back to this run's count
+            summary["folders_processed"] = summary["folders_done"]
+        images_per_folder = summary["images_done"]/float(summary["folders_done"]) if summary["folders_done"] > 0 else 0.0
+        summary["images_pending"] = int(round(images_per_folder*summary["folders_pending"]))
+        summary["eta_seconds"] = eta(summary["images_pending"], summary["images_per_sec"][eta_window])
+        for key in ["folders_done", "images_done", "folders_pending", "images_pending", "folders_processed"]:
+            overall[key] += summary[key]
+        for window, rate in summary["images_per_sec"].items():
+            overall["images_per_sec"][window] += rate
+    overall["eta_seconds"] = eta(overall["images_pending"], overall["images_per_sec"][eta_window])
+
+    return {"updated" : now, "populations" : populations, "overall" : overall, "workers" : workers}
+
+
+def eta(images_pending, images_per_sec):
+    if images_pending == 0:
+        return 0.0
+    if images_per_sec <= 0:
+        return None
+    return images_pending/images_per_sec
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "-"
+    hours, rest = divmod(int(seconds), 3600)
+    return "{}h{:02d}m".format(hours, rest // 60)
+
+
+def to_prometheus(summary):
+
+    """ Returns the summary in the Prometheus text exposition format """
+
+    lines = []
+    def metric(name, help_text, samples):
+        lines.append("# HELP pinpoint_{} {}".format(name, help_text))
+        lines.append("# TYPE pinpoint_{} gauge".format(name))
+        for labels, value in samples:
+            label_text = ",".join('{}="{}"'.format(k, v) for k, v in sorted(labels.items()))
+            lines.append("pinpoint_{}{{{}}} {}".format(name, label_text, "NaN" if value is None else value))
+
+    populations = summary["populations"]
+    for key, help_text in [("folders_pending", "Photo folders waiting to be processed."),
+                           ("folders_done", "Photo folders processed by the running workers since they started."),
+                           ("folders_processed", "Photo folders processed over the season."),
+                           ("images_pending", "Estimated images waiting to be processed."),
+                           ("images_done", "Images processed."),
+                           ("eta_seconds", "Estimated seconds until the backlog is cleared.")]:
+        metric(key, help_text, [({"population" : p}, populations[p][key]) for p in sorted(populations)] +
+                               [({"population" : "all"}, summary["overall"][key])])
+
+    metric("images_per_second", "Images processed per second over the window.",
+           [({"population" : p, "window" : w}, populations[p]["images_per_sec"][w]) for p in sorted(populations) for w in sorted(populations[p]["images_per_sec"], key = int)])
+    metric("worker_heartbeat_age_seconds", "Seconds since the worker last wrote its status.",
+           [({"worker" : w["worker_id"], "host" : w["host"]}, w["heartbeat_age"]) for w in summary["workers"]])
+    metric("worker_stalled", "1 if the worker has not written its status within the stale limit.",
+           [({"worker" : w["worker_id"], "host" : w["host"]}, int(w["stalled"])) for w in summary["workers"]])
+    return "\n".join(lines) + "\n"
+
+
+def print_summary(summary):
+    print("population  pending  processed  this run  images pending  img/s 1m  img/s 5m  img/s 15m  workers  ETA")
+    rows = sorted(summary["populations"].items(), key = lambda item: (len(item[0]), item[0]))
+    rows.append(("all", dict(summary["overall"], workers = sum(1 for w in summary["workers"] if not w["stalled"] and not w["finished"]))))
+    for population, s in rows:
+        rates = s["images_per_sec"]
+        print("{:>10}  {:>7}  {:>9}  {:>8}  {:>14}  {:>8.2f}  {:>8.2f}  {:>9.2f}  {:>7}  {}".format(
+            population, s["folders_pending"], s["folders_processed"], s["folders_done"], s["images_pending"],
+            rates["60"], rates["300"], rates["900"], s["workers"], format_duration(s["eta_seconds"])))
+    for worker in summary["workers"]:
+        if worker["stalled"]:
+            print("STALLED {} on {} (pid {}), last heartbeat {:.0f} s ago, folder {}".format(
+                worker["worker_id"], worker["host"], worker["pid"], worker["heartbeat_age"], worker["current_folder"]))
+
+
+def write_atomic(path, text):
+    with open(path + ".tmp", "w") as out_file:
+        out_file.write(text)
+    os.replace(path + ".tmp", path)
+
+
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(description = "Summarize the backlog and throughput of all workers.")
+    parser.add_argument("status_dir", nargs = "?", default = status_dir)
+    parser.add_argument("--json", default = None, help = "also write the summary to this JSON file")
+    parser.add_argument("--prom", default = None, help = "also write the summary to this Prometheus text file")
+    parser.add_argument("--stale", type = float, default = 300, help = "seconds without heartbeat before a worker counts as stalled")
+    parser.add_argument("--watch", type = float, default = 0, help = "repeat every this many seconds")
+    args = parser.parse_args()
+
+    while True:
+        summary = summarize(read_statuses(args.status_dir), args.stale)
+        print_summary(summary)
+        if args.json:
+            write_atomic(args.json, json.dumps(summary, indent = 2))
+        if args.prom:
+            write_atomic(args.prom, to_prometheus(summary))
+        if args.watch <= 0:
+            break
+        time.sleep(args.watch)
+        print("")